@@ -0,0 +1,321 @@
+"""
+Flask API for the dialer: /api/respond, keyword management, audio files and uploads.
+
+Importable without Streamlit, so production runs it under a multi-worker WSGI
+server (see README) and the Streamlit UI in app.py talks to it over HTTP only.
+Modules not needed on every start (pymysql) are imported when first used.
+"""
+import uuid
+from flask import Flask, Response, request, jsonify, send_file, stream_with_context
+import json
+import os
+from keywords import get_matcher, save_keywords, start_watcher
+from audio_catalog import AUDIO_VARIANTS, get_catalog
+from interaction_log import INTERACTION_LOG_ENABLED, get_interaction_logger
+from decision_cache import get_decision_cache
+
+app = Flask(__name__)
+
+NDJSON_MIMETYPE = "application/x-ndjson"
+API_PORT = int(os.environ.get("API_PORT", "5000"))
+API_BASE_URL = os.environ.get("API_BASE_URL", f"http://localhost:{API_PORT}")  # Used in returned audio links
+# Clients may reuse audio this long before revalidating it with its ETag
+AUDIO_CACHE_MAX_AGE = int(os.environ.get("AUDIO_CACHE_MAX_AGE", "300"))
+UPLOAD_CHUNK_SIZE = 256 * 1024  # Bytes read from an upload per write to the temporary file
+# Let a fronting web server send audio files itself (X-Sendfile) instead of the Python process
+app.config["USE_X_SENDFILE"] = os.environ.get("AUDIO_X_SENDFILE", "0") == "1"
+
+# Static audio file path, cached in memory and refreshed on change
+audio_catalog = get_catalog()
+audio_directory = audio_catalog.directory
+
+# Pick up keyword file edits without a restart
+start_watcher()
+
+# Function to get the default audio file (served from the in-memory catalog)
+def get_default_audio_file():
+    return audio_catalog.get_default()
+
+# MySQL configuration (logging enabled with INTERACTION_LOG_ENABLED=1)
+DB_CONFIG = {
+    "host": "localhost",
+    "user": "your_user",
+    "password": "your_password",
+    "database": "voicemail_db"
+}
+
+def get_db_connection():
+    import pymysql  # Only needed when interaction logging is enabled
+    return pymysql.connect(**DB_CONFIG)
+
+# Interactions are queued and written in batches by a background thread
+interaction_logger = get_interaction_logger(get_db_connection) if INTERACTION_LOG_ENABLED else None
+
+def log_interaction(user_uuid, phone_number, text, response, transfer, end):
+    if interaction_logger is not None:
+        interaction_logger.log(user_uuid, phone_number, text, response, transfer, end)
+
+def get_default_audio_link():
+    default_audio_file = get_default_audio_file()
+    return f"{API_BASE_URL}/audio/file/{default_audio_file}" if default_audio_file else ""
+
+def get_default_audio_duration():
+    # Read from the audio index; None until the background processor has indexed the file
+    default_audio_file = get_default_audio_file()
+    info = audio_catalog.info(default_audio_file) if default_audio_file else None
+    return info["duration"] if info else None
+
+# Repeat callers with the same greeting get their earlier response back without classification
+decision_cache = get_decision_cache()
+
+def classify_interaction(data, matcher, default_audio_link, default_audio_duration=None):
+    """
+    Classify one {uuid, phone_number, text} item and log it.
+
+    The matcher and default audio link are resolved by the caller, once per HTTP request,
+    so a batch is classified against one keyword set and one default audio file.
+    Responses for a known phone number and text come from the decision cache.
+    """
+    text = data.get("text", "")
+    user_uuid = data.get("uuid", str(uuid.uuid4()))
+    phone_number = data.get("phone_number", "")
+
+    cache_key = None
+    # Only string callers and texts are cached; anything else is classified as before
+    if decision_cache is not None and phone_number and isinstance(phone_number, str) and isinstance(text, str):
+        cache_key = decision_cache.key(phone_number, text)
+        epoch = (matcher.version, default_audio_link, default_audio_duration)
+        response_data = decision_cache.get(cache_key, epoch)
+        if response_data is not None:
+            log_interaction(user_uuid, phone_number, text, response_data["response"], response_data["transfer"], response_data["end"])
+            return response_data
+
+    # Check for exact matches of full keyword phrases
+    decision, match = matcher.classify(text)
+    is_voicemail = decision == "VM"
+    is_honeypot = decision == "No VM"
+
+    # Prepare response based on keyword detection
+    if is_voicemail:
+        response_data = {
+            "audio_link": default_audio_link,
+            "response": "VM",
+            "transfer": 0,
+            "end": 1
+        }
+        if default_audio_duration is not None:
+            response_data["audio_duration"] = default_audio_duration
+    elif is_honeypot:
+        response_data = {
+            "audio_link": "",
+            "response": "No VM",
+            "transfer": 0,
+            "end": 1
+        }
+    else:
+        response_data = {
+            "audio_link": "",
+            "response": "not available",
+            "transfer": 0,
+            "end": 1
+        }
+
+    # The deciding phrase plus every phrase found, with offsets into the text
+    response_data["match"] = match
+    response_data["matches"] = matcher.find(text)
+    response_data["keywords_version"] = matcher.version
+    if cache_key is not None:
+        decision_cache.put(cache_key, epoch, response_data)
+
+    log_interaction(user_uuid, phone_number, text, response_data["response"], response_data["transfer"], response_data["end"])
+    return response_data
+
+def text_error(data):
+    # The matcher and the decision cache need the text as a string
+    text = data.get("text", "")
+    if text is not None and not isinstance(text, str):
+        return "text must be a string"
+    return None
+
+@app.route("/api/respond", methods=["POST"])
+def respond():
+    data = request.json or {}
+    error = text_error(data)
+    if error:
+        return jsonify({"error": error}), 400
+    return jsonify(classify_interaction(data, get_matcher(), get_default_audio_link(), get_default_audio_duration()))
+
+@app.route("/api/respond/batch", methods=["POST"])
+def respond_batch():
+    """
+    Classify many utterances in one round trip.
+
+    Accepts a JSON array of {uuid, phone_number, text} objects (or {"items": [...]})
+    and returns {"results": [...]} in input order. With Content-Type
+    application/x-ndjson, items are read one per line and results are streamed back
+    one per line as they are classified; a JSON array body gets NDJSON back when the
+    Accept header asks for application/x-ndjson.
+    """
+    matcher = get_matcher()
+    default_audio_link = get_default_audio_link()
+    default_audio_duration = get_default_audio_duration()
+
+    def classify_item(item):
+        if not isinstance(item, dict):
+            return {"error": "Item must be an object with uuid, phone_number and text"}
+        error = text_error(item)
+        if error:
+            return {"error": error}
+        result = classify_interaction(item, matcher, default_audio_link, default_audio_duration)
+        if "uuid" in item:
+            result = {"uuid": item["uuid"], **result}
+        return result
+
+    if request.mimetype == NDJSON_MIMETYPE:
+        def generate_ndjson():
+            for line in request.stream:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    item = json.loads(line)
+                except ValueError:
+                    item = None
+                yield json.dumps(classify_item(item)) + "\n"
+        return Response(stream_with_context(generate_ndjson()), mimetype=NDJSON_MIMETYPE)
+
+    data = request.get_json(silent=True)
+    items = data.get("items") if isinstance(data, dict) else data
+    if not isinstance(items, list):
+        return jsonify({"error": "Expected a JSON array of items"}), 400
+
+    results = [classify_item(item) for item in items]
+    if NDJSON_MIMETYPE in request.headers.get("Accept", ""):
+        return Response("".join(json.dumps(result) + "\n" for result in results), mimetype=NDJSON_MIMETYPE)
+    return jsonify({"results": results})
+
+@app.route("/api/stats", methods=["GET"])
+def stats():
+    return jsonify({
+        "interaction_log": interaction_logger.stats() if interaction_logger is not None else None,
+        "decision_cache": decision_cache.stats() if decision_cache is not None else None
+    })
+
+@app.route("/api/keywords", methods=["GET"])
+def get_keywords():
+    matcher = get_matcher()
+    return jsonify({
+        "version": matcher.version,
+        "voicemail": list(matcher.voicemail),
+        "honeypot": list(matcher.honeypot)
+    })
+
+@app.route("/api/keywords", methods=["PUT"])
+def update_keywords():
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"error": "Invalid JSON payload"}), 400
+    try:
+        matcher = save_keywords(data.get("voicemail"), data.get("honeypot"))
+    except ValueError as e:
+        return jsonify({"error": str(e), "version": get_matcher().version}), 400
+    except OSError as e:
+        return jsonify({"error": f"Keywords applied but not saved: {e}", "version": get_matcher().version}), 500
+    return jsonify({"version": matcher.version}), 200
+
+@app.route("/audio/file/<filename>")
+def get_audio_file(filename):
+    # ?format=ulaw8k | wav16k serves a pre-transcoded telephony variant instead of the MP3
+    variant = request.args.get("format")
+    try:
+        path, etag = audio_catalog.resolve(filename, variant)
+    except FileNotFoundError:
+        return jsonify({"error": f"File {filename} not found"}), 404
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except RuntimeError as e:
+        return jsonify({"error": str(e)}), 500
+    except Exception as e:
+        return jsonify({"error": f"Error preparing {variant} audio: {e}"}), 500
+    # Conditional and Range requests are answered from the ETag and file size; the body goes out
+    # through the server's file wrapper (sendfile under gunicorn) or X-Sendfile when enabled
+    return send_file(
+        os.path.abspath(path),  # Flask resolves relative paths against the app's root, not the working directory
+        mimetype="audio/wav" if variant else "audio/mpeg",
+        conditional=True,
+        etag=etag,
+        max_age=AUDIO_CACHE_MAX_AGE
+    )
+
+@app.route("/upload", methods=["POST"])
+def upload_file():
+    # An audio/mpeg body with ?filename= is streamed straight into the catalog; multipart
+    # form uploads are still accepted but are buffered by the form parser first
+    if request.mimetype == "audio/mpeg":
+        filename = request.args.get("filename", "")
+        stream = request.stream
+    else:
+        if 'file' not in request.files:
+            return jsonify({"error": "No file provided"}), 400
+        file = request.files['file']
+        filename = file.filename
+        stream = file.stream
+    if filename == '':
+        return jsonify({"error": "No file selected"}), 400
+    if filename != os.path.basename(filename) or filename.startswith("."):
+        return jsonify({"error": f"Invalid file name {filename}"}), 400
+    if not filename.endswith('.mp3'):
+        return jsonify({"error": "Invalid file format, only MP3 allowed"}), 400
+    try:
+        stored, duplicate = audio_catalog.store(filename, iter(lambda: stream.read(UPLOAD_CHUNK_SIZE), b""))
+    except OSError as e:
+        return jsonify({"error": f"Error saving {filename}: {e}"}), 500
+    audio_url = f"{API_BASE_URL}/audio/file/{stored}"
+    return jsonify({
+        "audio_url": audio_url,
+        "filename": stored,
+        "duplicate": duplicate,
+        "variants": {variant: f"{audio_url}?format={variant}" for variant in AUDIO_VARIANTS}
+    }), 200
+
+@app.route("/api/audio", methods=["GET"])
+def list_audio_files():
+    default_audio_file = get_default_audio_file()
+    return jsonify({
+        "default": default_audio_file,
+        "files": [
+            {
+                "filename": filename,
+                "audio_url": f"{API_BASE_URL}/audio/file/{filename}",
+                "default": filename == default_audio_file,
+                "info": audio_catalog.info(filename)
+            }
+            for filename in audio_catalog.files()
+        ]
+    })
+
+@app.route("/api/audio/default", methods=["PUT"])
+def set_default_audio_file():
+    data = request.get_json(silent=True)
+    filename = data.get("filename") if isinstance(data, dict) else None
+    if not filename:
+        return jsonify({"error": "Expected {\"filename\": ...}"}), 400
+    try:
+        audio_catalog.set_default(filename)
+    except FileNotFoundError as e:
+        return jsonify({"error": str(e)}), 404
+    return jsonify({"default": filename}), 200
+
+@app.route("/api/audio/<filename>", methods=["DELETE"])
+def delete_audio_file(filename):
+    if filename not in audio_catalog.files():
+        return jsonify({"error": f"File {filename} not found"}), 404
+    try:
+        was_default = audio_catalog.remove_file(filename)
+    except FileNotFoundError:
+        return jsonify({"error": f"File {filename} not found"}), 404
+    return jsonify({"deleted": filename, "was_default": was_default}), 200
+
+if __name__ == "__main__":
+    # Development server; use a WSGI server such as gunicorn in production
+    app.run(host=os.environ.get("API_HOST", "127.0.0.1"), port=API_PORT, threaded=True)
@@ -0,0 +1,522 @@
+"""
+In-process cache of the VM audio files and the default selection.
+
+The upload, set-default and delete paths update the cache directly. A watcher
+thread stats the audio directory and default_audio.txt every
+AUDIO_CATALOG_POLL_INTERVAL seconds and rescans when either changes, so edits made
+outside the process show up within that window. Readers such as /api/respond only
+touch memory.
+
+Uploads are streamed into a temporary file in the audio directory while they are
+hashed, then renamed into place, and content already in the catalog is not stored
+twice. A background processor decodes each new file once to record its duration,
+sample rate and loudness in audio_files/index.json and to build the telephony
+variants (8 kHz mu-law, 16 kHz PCM) kept under audio_files/.variants. Requests for
+a variant that is not built yet transcode it on the spot.
+
+Files are served with their SHA-256 as a strong ETag.
+"""
+import hashlib
+import json
+import logging
+import math
+import os
+import queue
+import tempfile
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+AUDIO_DIRECTORY = os.environ.get("AUDIO_DIRECTORY", "audio_files")
+AUDIO_CATALOG_POLL_INTERVAL = float(os.environ.get("AUDIO_CATALOG_POLL_INTERVAL", "1"))
+VARIANTS_DIRECTORY = ".variants"  # Inside AUDIO_DIRECTORY; not listed as an audio file
+INDEX_FILE = "index.json"  # Inside AUDIO_DIRECTORY; per-file hash and audio properties
+
+# mkstemp creates owner-only files; stored files get the mode open() would give them, so a
+# web server running as another user (AUDIO_X_SENDFILE) can still read them
+_umask = os.umask(0)
+os.umask(_umask)
+FILE_MODE = 0o666 & ~_umask
+
+# Pre-transcoded variants served with ?format=<name>; every variant is a mono WAV file
+AUDIO_VARIANTS = {
+    "ulaw8k": {"frame_rate": 8000, "codec": "pcm_mulaw"},
+    "wav16k": {"frame_rate": 16000, "codec": "pcm_s16le"},
+}
+
+def load_audio(path):
+    """
+    Decode an audio file with pydub.
+    """
+    from pydub import AudioSegment  # Needs ffmpeg; only loaded by the processor and variant builds
+    return AudioSegment.from_file(path)
+
+def transcode(audio, target_path, variant):
+    """
+    Write decoded audio in one of the AUDIO_VARIANTS formats.
+    """
+    spec = AUDIO_VARIANTS[variant]
+    audio.set_channels(1).set_frame_rate(spec["frame_rate"]).export(target_path, format="wav", codec=spec["codec"])
+
+def describe_audio(audio):
+    """
+    Summarize decoded audio for the index: duration, sample rate, channels and loudness.
+    """
+    def level(value):
+        return round(value, 2) if math.isfinite(value) else None  # Digital silence is -inf dBFS
+
+    return {
+        "duration": round(len(audio) / 1000, 3),
+        "sample_rate": audio.frame_rate,
+        "channels": audio.channels,
+        "dbfs": level(audio.dBFS),
+        "max_dbfs": level(audio.max_dBFS)
+    }
+
+class AudioCatalog:
+    """
+    Cached list of the audio files and the current default.
+
+    State is held in one immutable tuple replaced under a lock, so readers never need it.
+    `generation` increases on every change for callers that cache derived data.
+    Content hashes are cached per file until its size or modification time changes. The
+    index is also an immutable dict replaced on change, so index() never blocks either.
+    """
+
+    def __init__(self, directory=AUDIO_DIRECTORY, poll_interval=AUDIO_CATALOG_POLL_INTERVAL):
+        self.directory = directory
+        self.default_file_path = os.path.join(directory, "default_audio.txt")
+        self.variants_directory = os.path.join(directory, VARIANTS_DIRECTORY)
+        self.index_path = os.path.join(directory, INDEX_FILE)
+        self.poll_interval = poll_interval
+        self.generation = 0
+        self._lock = threading.Lock()
+        self._state = ((), None)  # (audio file names, default file name)
+        self._watcher = None
+        self._hashes = {}  # File name -> ((size, mtime_ns), SHA-256 hex digest)
+        self._index = {}  # File name -> index entry, replaced as a whole
+        self._store_lock = threading.Lock()  # Serializes the duplicate check and rename of uploads
+        self._transcode_lock = threading.Lock()  # Variants are built one at a time, never twice
+        self._process_queue = queue.Queue()
+        self._processor = None
+        self.variants_built = 0
+        self.indexed = 0
+        os.makedirs(directory, exist_ok=True)
+        self._load_index()
+        self.refresh()
+
+    def _stamp(self):
+        stamp = []
+        for path in (self.directory, self.default_file_path):
+            try:
+                stamp.append(os.stat(path).st_mtime_ns)
+            except OSError:
+                stamp.append(None)
+        return tuple(stamp)
+
+    def _publish(self, files, default):
+        if default not in files:
+            default = None
+        state = (tuple(files), default)
+        if state != self._state:
+            self._state = state
+            self.generation += 1
+
+    def refresh(self):
+        """
+        Rescan the audio directory and re-read the default selection from disk.
+        """
+        with self._lock:
+            stamp = self._stamp()
+            try:
+                files = sorted(f for f in os.listdir(self.directory) if f.endswith(".mp3"))
+            except OSError as e:
+                logger.error(f"Error reading audio directory: {e}")
+                files = []
+            default = None
+            try:
+                with open(self.default_file_path, "r") as f:
+                    default = f.read().strip() or None
+            except OSError:
+                pass
+            self._publish(files, default)
+            self._last_stamp = stamp
+        self._sync_index(files)
+
+    def files(self):
+        """
+        Return the audio file names.
+        """
+        return list(self._state[0])
+
+    def get_default(self):
+        """
+        Return the default audio file name, or None if no existing file is selected.
+        """
+        return self._state[1]
+
+    def set_default(self, filename):
+        """
+        Make an audio file the default and persist the selection.
+
+        Raises:
+            FileNotFoundError: If the file is not in the catalog.
+        """
+        with self._lock:
+            files = self._state[0]
+            if filename not in files:
+                raise FileNotFoundError(f"File {filename} not found")
+            with open(self.default_file_path, "w") as f:
+                f.write(filename)
+            self._publish(files, filename)
+            self._last_stamp = self._stamp()
+
+    def clear_default(self):
+        """
+        Remove the default selection.
+        """
+        with self._lock:
+            try:
+                os.remove(self.default_file_path)
+            except FileNotFoundError:
+                pass
+            self._publish(self._state[0], None)
+            self._last_stamp = self._stamp()
+
+    def add_file(self, filename):
+        """
+        Record a file that was just written to the audio directory.
+        """
+        with self._lock:
+            files, default = self._state
+            if filename not in files:
+                self._publish(sorted(files + (filename,)), default)
+            self._last_stamp = self._stamp()
+
+    def remove_file(self, filename):
+        """
+        Delete an audio file, clearing the default if it was the default.
+
+        Returns:
+            bool: True if the deleted file was the default.
+
+        Raises:
+            FileNotFoundError: If the file does not exist.
+        """
+        with self._lock:
+            files, default = self._state
+            os.remove(os.path.join(self.directory, filename))
+            was_default = default == filename
+            cached = self._hashes.pop(filename, None)
+            if cached is not None:
+                self._prune_variants(cached[1])
+            self._drop_from_index(filename)
+            if was_default:
+                try:
+                    os.remove(self.default_file_path)
+                except FileNotFoundError:
+                    pass
+                default = None
+            self._publish([f for f in files if f != filename], default)
+            self._last_stamp = self._stamp()
+            return was_default
+
+    def path(self, filename):
+        """
+        Return the path of an audio file in the catalog directory.
+        """
+        return os.path.join(self.directory, filename)
+
+    def content_hash(self, filename):
+        """
+        Return the SHA-256 of an audio file, hashing it only if it changed since the last call.
+
+        Raises:
+            FileNotFoundError: If the file does not exist.
+        """
+        path = self.path(filename)
+        stat = os.stat(path)
+        stamp = (stat.st_size, stat.st_mtime_ns)
+        cached = self._hashes.get(filename)
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(block)
+        content_hash = digest.hexdigest()
+        self._hashes[filename] = (stamp, content_hash)
+        if cached is not None and cached[1] != content_hash:
+            # The file was replaced; variants of the old content are no longer reachable
+            self._prune_variants(cached[1])
+        return content_hash
+
+    def resolve(self, filename, variant=None):
+        """
+        Find the file to serve for an audio file or one of its variants, building the variant if needed.
+
+        Args:
+            filename (str): Audio file name in the catalog.
+            variant (str): Key of AUDIO_VARIANTS, or None for the uploaded file.
+
+        Returns:
+            tuple: (path, strong ETag value).
+
+        Raises:
+            FileNotFoundError: If the file is not in the catalog.
+            ValueError: If the variant is unknown.
+            RuntimeError: If the variant could not be built (e.g. ffmpeg is missing).
+        """
+        if filename not in self._state[0]:
+            raise FileNotFoundError(f"File {filename} not found")
+        if variant is not None and variant not in AUDIO_VARIANTS:
+            raise ValueError(f"Unsupported format {variant}, use one of: {', '.join(AUDIO_VARIANTS)}")
+        content_hash = self.content_hash(filename)
+        if variant is None:
+            return self.path(filename), content_hash
+        try:
+            path = self._build_variant(filename, content_hash, variant)
+        except Exception as e:
+            # pydub reports a missing ffmpeg binary as FileNotFoundError too; only a vanished file is not found
+            if not os.path.exists(self.path(filename)):
+                raise FileNotFoundError(f"File {filename} not found") from e
+            raise RuntimeError(f"Error building {variant} variant of {filename}: {e}") from e
+        return path, f"{content_hash}-{variant}"
+
+    def info(self, filename):
+        """
+        Return the index entry of an audio file (duration, sample_rate, channels, dbfs,
+        max_dbfs), or None if it has not been indexed yet. Never reads the audio.
+        """
+        return self._index.get(filename)
+
+    def index(self):
+        """
+        Return the index entries of all indexed files.
+        """
+        return dict(self._index)
+
+    def store(self, filename, chunks):
+        """
+        Stream an upload into the audio directory.
+
+        The data is hashed while it is written to a temporary file in the directory, then
+        renamed over `filename` in one step, so readers never see a partial file. If the
+        content is already in the catalog under any name, nothing is stored.
+
+        Args:
+            filename (str): Name to store the file under.
+            chunks (iterable): The upload as an iterable of bytes.
+
+        Returns:
+            tuple: (name of the file holding the content, True if it was already in the catalog).
+        """
+        digest = hashlib.sha256()
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".upload")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in chunks:
+                    digest.update(chunk)
+                    f.write(chunk)
+            content_hash = digest.hexdigest()
+            with self._store_lock:
+                existing = self.find(content_hash)
+                if existing is not None:
+                    os.remove(temp_path)
+                    logger.info(f"Upload {filename} duplicates {existing}, not stored")
+                    return existing, True
+                os.chmod(temp_path, FILE_MODE)
+                os.replace(temp_path, self.path(filename))
+                stat = os.stat(self.path(filename))
+                previous = self._hashes.get(filename)
+                self._hashes[filename] = ((stat.st_size, stat.st_mtime_ns), content_hash)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        if previous is not None and previous[1] != content_hash:
+            self._prune_variants(previous[1])
+        self.add_file(filename)
+        self.schedule(filename)
+        return filename, False
+
+    def find(self, content_hash):
+        """
+        Return the name of a catalog file with the given SHA-256, or None.
+
+        Only files hashed so far are considered; the processor hashes every file it indexes.
+        """
+        files = self._state[0]
+        for filename, (_, known_hash) in list(self._hashes.items()):
+            if known_hash == content_hash and filename in files:
+                try:
+                    if self.content_hash(filename) == content_hash:
+                        return filename
+                except FileNotFoundError:
+                    pass
+        return None
+
+    def _variant_path(self, content_hash, variant):
+        return os.path.join(self.variants_directory, f"{content_hash}.{variant}.wav")
+
+    def _build_variant(self, filename, content_hash, variant, audio=None):
+        target_path = self._variant_path(content_hash, variant)
+        if os.path.exists(target_path):
+            return target_path
+        with self._transcode_lock:
+            if os.path.exists(target_path):
+                return target_path
+            os.makedirs(self.variants_directory, exist_ok=True)
+            temp_path = f"{target_path}.{threading.get_ident()}.tmp"
+            start_time = time.time()
+            try:
+                transcode(audio if audio is not None else load_audio(self.path(filename)), temp_path, variant)
+                os.replace(temp_path, target_path)
+            finally:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+            self.variants_built += 1
+            logger.info(f"Built {variant} variant of {filename} in {time.time() - start_time:.2f} seconds")
+        return target_path
+
+    def _prune_variants(self, content_hash):
+        if any(cached[1] == content_hash for cached in list(self._hashes.values())):
+            return  # Another file has the same content
+        for variant in AUDIO_VARIANTS:
+            try:
+                os.remove(self._variant_path(content_hash, variant))
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.error(f"Error removing {variant} variant {content_hash}: {e}")
+
+    def schedule(self, filename):
+        """
+        Queue a file for the background processor, which indexes it and builds its variants.
+        """
+        with self._lock:
+            if self._processor is None:
+                self._processor = threading.Thread(target=self._process_queued, name="audio-processor", daemon=True)
+                self._processor.start()
+        self._process_queue.put(filename)
+
+    def _process_queued(self):
+        while True:
+            self._process(self._process_queue.get())
+
+    def _process(self, filename):
+        if filename not in self._state[0]:
+            return  # Deleted before its turn
+        try:
+            content_hash = self.content_hash(filename)
+            entry = self._index.get(filename)
+            pending = [variant for variant in AUDIO_VARIANTS
+                       if not os.path.exists(self._variant_path(content_hash, variant))]
+            if entry is not None and entry["sha256"] == content_hash and not pending:
+                return
+            start_time = time.time()
+            audio = load_audio(self.path(filename))
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            logger.error(f"Error decoding {filename}: {e}")
+            return
+        if entry is None or entry["sha256"] != content_hash:
+            stamp = self._hashes[filename][0]
+            entry = {"sha256": content_hash, "size": stamp[0], "mtime_ns": stamp[1], **describe_audio(audio)}
+            self._update_index(filename, entry)
+            self.indexed += 1
+            logger.info(f"Indexed {filename} in {time.time() - start_time:.2f} seconds: {entry}")
+        for variant in pending:
+            try:
+                self._build_variant(filename, content_hash, variant, audio)
+            except Exception as e:
+                logger.error(f"Error building {variant} variant of {filename}: {e}")
+
+    def _load_index(self):
+        try:
+            with open(self.index_path, "r") as f:
+                index = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logger.error(f"Ignoring unreadable audio index {self.index_path}: {e}")
+            return
+        self._index = index
+        for filename, entry in index.items():
+            # Reuse recorded hashes so files are not rehashed after a restart
+            self._hashes[filename] = ((entry["size"], entry["mtime_ns"]), entry["sha256"])
+
+    def _update_index(self, filename, entry):
+        with self._lock:
+            if filename in self._state[0]:
+                self._index = {**self._index, filename: entry}
+                self._write_index()
+
+    def _drop_from_index(self, filename):
+        if filename in self._index:
+            self._index = {name: entry for name, entry in self._index.items() if name != filename}
+            self._write_index()
+
+    def _sync_index(self, files):
+        """
+        Drop index entries of files that are gone and queue files that are new or changed.
+        """
+        with self._lock:
+            for filename in set(self._index) - set(files):
+                self._drop_from_index(filename)
+        for filename in files:
+            entry = self._index.get(filename)
+            try:
+                stat = os.stat(self.path(filename))
+            except OSError:
+                continue
+            if entry is None or (entry["size"], entry["mtime_ns"]) != (stat.st_size, stat.st_mtime_ns):
+                self.schedule(filename)
+
+    def _write_index(self):
+        try:
+            fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        except OSError as e:
+            logger.error(f"Error writing audio index: {e}")
+            return
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(self._index, f, indent=4)
+            os.chmod(temp_path, FILE_MODE)
+            os.replace(temp_path, self.index_path)
+        except OSError as e:
+            os.unlink(temp_path)
+            logger.error(f"Error writing audio index: {e}")
+
+    def _watch(self):
+        while True:
+            time.sleep(self.poll_interval)
+            if self._stamp() != self._last_stamp:
+                self.refresh()
+
+    def start_watcher(self):
+        """
+        Start the background thread that picks up changes made outside this process.
+
+        Safe to call more than once; only one watcher runs per catalog.
+        """
+        with self._lock:
+            if self._watcher is None:
+                self._watcher = threading.Thread(target=self._watch, name="audio-catalog-watcher", daemon=True)
+                self._watcher.start()
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+def get_catalog():
+    """
+    Return the process-wide catalog, creating it and starting its watcher on first use.
+    """
+    global _catalog
+    with _catalog_lock:
+        if _catalog is None:
+            _catalog = AudioCatalog()
+            _catalog.start_watcher()
+        return _catalog
@@ -0,0 +1,537 @@
+"""
+Offline benchmark and load test for the Flask API, the Vosk WebSocket server and
+the FastAPI transcription client.
+
+    python benchmark.py                                   # All services at concurrency 1, 8 and 32
+    python benchmark.py respond --concurrency 1,4,16,64 --requests 2000 --output run.json
+    python benchmark.py recognize transcribe --compare baseline.json
+
+Each service is started as a subprocess on a free local port and driven by
+closed-loop asyncio workers, one level of concurrency at a time:
+
+- respond: POST /api/respond (api.py) with a synthetic keyword-text corpus of
+  voicemail, honeypot and neutral greetings, part of it redialled numbers.
+- recognize: WebSocket sessions straight to vosk_server.py.
+- transcribe: POST /transcribe (client.py) for clips served from a local HTTP
+  server, through vosk_server.py.
+
+The audio paths use a generated corpus of tones, silence and speech-like noise,
+and vosk_server.py runs with VOSK_STUB=1, so no model or network access is needed
+and the numbers cover transport and conversion overhead only. Results (requests/s,
+p50/p95/p99 latency in ms, peak RSS per service process from /proc on Linux) are
+printed as JSON and can be compared against an earlier run with --compare.
+"""
+import argparse
+import asyncio
+import contextlib
+import itertools
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import wave
+from datetime import datetime, timezone
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+import httpx
+import numpy as np
+import websockets
+from keywords import honeypot_keywords, voicemail_keywords
+
+REPO_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+SERVICES = ("respond", "recognize", "transcribe")
+SAMPLE_RATE = 16000
+WS_FRAME_BYTES = 8000  # 0.25 seconds of 16 kHz 16-bit audio per WebSocket frame
+STARTUP_TIMEOUT = 60.0  # Seconds a service gets to start listening
+REQUEST_TIMEOUT = 120.0
+
+FILLER_WORDS = [
+    "hello", "hi", "you", "have", "reached", "the", "office", "of", "john", "sorry", "i", "am", "not",
+    "here", "thanks", "for", "calling", "good", "morning", "yes", "who", "is", "this", "okay", "right", "now"
+]
+
+def text_corpus(size, seed, repeat_ratio=0.3, phone_numbers=1000):
+    """
+    Build /api/respond payloads: filler words around an optional voicemail or honeypot phrase.
+
+    Args:
+        size (int): Number of payloads.
+        seed (int): Random seed, so runs are comparable.
+        repeat_ratio (float): Share of payloads that redial an earlier number with the same text.
+        phone_numbers (int): Size of the phone number pool.
+
+    Returns:
+        list: Dicts with uuid, phone_number and text.
+    """
+    rng = random.Random(seed)
+    items = []
+    for i in range(size):
+        if items and rng.random() < repeat_ratio:
+            items.append({**rng.choice(items), "uuid": f"bench-{i}"})
+            continue
+        words = rng.choices(FILLER_WORDS, k=rng.randint(4, 20))
+        kind = rng.random()
+        phrase = rng.choice(voicemail_keywords) if kind < 0.4 else rng.choice(honeypot_keywords) if kind < 0.7 else None
+        if phrase:
+            words.insert(rng.randint(0, len(words)), phrase.lower())
+        items.append({
+            "uuid": f"bench-{i}",
+            "phone_number": f"555{rng.randrange(phone_numbers):07d}",
+            "text": " ".join(words)
+        })
+    return items
+
+def silence(seconds, rng):
+    # Line noise around -70 dBFS rather than digital zeros
+    return rng.normal(0, 10, int(seconds * SAMPLE_RATE))
+
+def tone(seconds, frequency, level=0.3):
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    return level * 32767 * np.sin(2 * np.pi * frequency * t)
+
+def speech_like(seconds, rng, level=0.1):
+    """
+    Generate voiced, syllable-paced noise with a drifting pitch and a few harmonics.
+    """
+    n = int(seconds * SAMPLE_RATE)
+    t = np.arange(n) / SAMPLE_RATE
+    pitch = 120 + 40 * np.sin(2 * np.pi * 0.5 * t + rng.uniform(0, 2 * np.pi)) + rng.normal(0, 3, n)
+    phase = 2 * np.pi * np.cumsum(pitch) / SAMPLE_RATE
+    voiced = sum(np.sin(k * phase) / k for k in range(1, 6))
+    syllables = np.clip(np.sin(2 * np.pi * rng.uniform(3, 5) * t), 0, None) ** 2
+    return level * 32767 * (voiced * syllables + 0.2 * rng.normal(0, 1, n) * syllables)
+
+def audio_corpus(directory, seconds, seed):
+    """
+    Write the benchmark clips as raw 16 kHz PCM (.raw) and WAV (.wav) files.
+
+    Returns:
+        list: Clip names without extension.
+    """
+    rng = np.random.default_rng(seed)
+    clips = {
+        "silence": silence(seconds, rng),
+        "tones": np.concatenate([tone(0.5, 440), silence(0.5, rng), tone(0.5, 1000), silence(seconds - 1.5, rng)]),
+        "speech": speech_like(seconds, rng),
+        "greeting": np.concatenate([speech_like(seconds - 1, rng), tone(0.5, 1000), silence(0.5, rng)])
+    }
+    for name, samples in clips.items():
+        pcm = np.clip(samples, -32768, 32767).astype("<i2").tobytes()
+        with open(os.path.join(directory, f"{name}.raw"), "wb") as f:
+            f.write(pcm)
+        with wave.open(os.path.join(directory, f"{name}.wav"), "wb") as f:
+            f.setnchannels(1)
+            f.setsampwidth(2)
+            f.setframerate(SAMPLE_RATE)
+            f.writeframes(pcm)
+    return list(clips)
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def peak_rss_mb(pid):
+    """
+    Return the peak resident set size of a process in MB, or None where /proc is unavailable.
+    """
+    try:
+        with open(f"/proc/{pid}/status", "r") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+def reset_peak_rss(pid):
+    """
+    Reset a process's peak resident set size to its current RSS, so the next peak_rss_mb()
+    reports the peak since this call. Returns False where /proc/<pid>/clear_refs is unavailable.
+    """
+    try:
+        with open(f"/proc/{pid}/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+class Service:
+    """
+    A service under test, run as a subprocess with its output in a log file.
+    """
+
+    def __init__(self, name, args, port, env, workdir):
+        self.name = name
+        self.args = args
+        self.port = port
+        self.env = {**os.environ, **env}
+        self.workdir = workdir
+        self.log_path = os.path.join(workdir, f"{name}.log")
+        self.process = None
+
+    def start(self):
+        """
+        Start the process and wait until it accepts connections.
+
+        Raises:
+            RuntimeError: If the process exits or does not listen within STARTUP_TIMEOUT.
+        """
+        with open(self.log_path, "wb") as log:
+            self.process = subprocess.Popen(self.args, cwd=self.workdir, env=self.env,
+                                            stdout=log, stderr=subprocess.STDOUT)
+        deadline = time.monotonic() + STARTUP_TIMEOUT
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"{self.name} exited with {self.process.returncode}:\n{self.log_tail()}")
+            try:
+                socket.create_connection(("127.0.0.1", self.port), timeout=0.5).close()
+                return
+            except OSError:
+                time.sleep(0.1)
+        raise RuntimeError(f"{self.name} did not listen on port {self.port}:\n{self.log_tail()}")
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+
+    def peak_rss_mb(self):
+        return peak_rss_mb(self.process.pid)
+
+    def reset_peak_rss(self):
+        return reset_peak_rss(self.process.pid)
+
+    def log_tail(self, lines=20):
+        with open(self.log_path, "r", errors="replace") as f:
+            return "".join(f.readlines()[-lines:])
+
+@contextlib.contextmanager
+def running(*services):
+    try:
+        for service in services:
+            service.start()
+        yield services
+    finally:
+        for service in reversed(services):
+            service.stop()
+
+def api_service(workdir, args):
+    port = free_port()
+    env = {
+        "API_PORT": str(port),
+        "API_BASE_URL": f"http://127.0.0.1:{port}",
+        "AUDIO_DIRECTORY": os.path.join(workdir, "audio_files"),
+        "KEYWORDS_FILE": os.path.join(workdir, "keywords.json"),
+        "INTERACTION_LOG_ENABLED": "0",
+        "DECISION_CACHE_ENABLED": "0" if args.no_decision_cache else "1"
+    }
+    return Service("api", [sys.executable, os.path.join(REPO_DIRECTORY, "api.py")], port, env, workdir)
+
+def vosk_service(workdir, args):
+    port = free_port()
+    env = {
+        "VOSK_STUB": "1",
+        "VOSK_SERVER_HOST": "127.0.0.1",
+        "VOSK_SERVER_PORT": str(port),
+        "VOSK_POOL_SIZE": str(max(args.concurrency)),
+        "VOSK_POOL_TIMEOUT": str(REQUEST_TIMEOUT),
+        "KEYWORDS_FILE": os.path.join(workdir, "keywords.json"),
+        "LOG_LEVEL": args.log_level
+    }
+    return Service("vosk_server", [sys.executable, os.path.join(REPO_DIRECTORY, "vosk_server.py")], port, env, workdir)
+
+def client_service(workdir, args, vosk_port):
+    port = free_port()
+    env = {
+        "VOSK_BACKENDS": f"ws://127.0.0.1:{vosk_port}",
+        "TRANSCRIBE_CONCURRENCY": str(max(args.concurrency)),
+        "TRANSCRIBE_QUEUE_DEPTH": str(max(args.concurrency) * 4),
+        "TRANSCRIPTION_CACHE_ENABLED": "0",  # Every request goes through the recognizer
+        "LOG_LEVEL": args.log_level
+    }
+    command = [sys.executable, "-m", "uvicorn", "--app-dir", REPO_DIRECTORY, "--host", "127.0.0.1",
+               "--port", str(port), "--log-level", "warning", "client:app"]
+    return Service("client", command, port, env, workdir)
+
+@contextlib.contextmanager
+def static_files(directory):
+    """
+    Serve a directory over HTTP from a background thread; yields its base URL.
+    """
+    class QuietHandler(SimpleHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), partial(QuietHandler, directory=directory))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_address[1]}"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+def summarize(concurrency, latencies, errors, elapsed):
+    """
+    Reduce one load level to counts, throughput and latency percentiles.
+    """
+    latencies_ms = np.array(latencies) * 1000
+
+    def percentile(q):
+        return round(float(np.percentile(latencies_ms, q)), 2) if len(latencies_ms) else None
+
+    return {
+        "concurrency": concurrency,
+        "requests": len(latencies) + errors,
+        "errors": errors,
+        "seconds": round(elapsed, 3),
+        "rps": round(len(latencies) / elapsed, 2) if elapsed else None,
+        "p50_ms": percentile(50),
+        "p95_ms": percentile(95),
+        "p99_ms": percentile(99)
+    }
+
+async def run_level(concurrency, total, request):
+    """
+    Run `total` requests with `concurrency` closed-loop workers.
+
+    Args:
+        concurrency (int): Requests in flight at any time.
+        total (int): Requests to send.
+        request (callable): Coroutine function taking the request index and returning True on success.
+
+    Returns:
+        dict: Summary from summarize().
+    """
+    counter = itertools.count()
+    latencies = []
+    errors = 0
+    first_error = []
+
+    async def worker():
+        nonlocal errors
+        while (index := next(counter)) < total:
+            start_time = time.perf_counter()
+            try:
+                ok = await asyncio.wait_for(request(index), REQUEST_TIMEOUT)
+            except Exception as e:
+                ok = False
+                first_error.append(repr(e))
+            if ok:
+                latencies.append(time.perf_counter() - start_time)
+            else:
+                errors += 1
+
+    start_time = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    summary = summarize(concurrency, latencies, errors, time.perf_counter() - start_time)
+    if first_error:
+        summary["first_error"] = first_error[0]
+    return summary
+
+async def run_levels(args, request, services):
+    """
+    Warm up, then run every concurrency level and record each service's peak RSS during it.
+
+    The peak is reset before each level; where the kernel does not allow that, the level's
+    summary says so with "peak_rss_cumulative" and its peak includes all earlier levels.
+    """
+    if args.warmup:
+        await run_level(min(args.warmup, max(args.concurrency)), args.warmup, request)
+    levels = []
+    for concurrency in args.concurrency:
+        reset = all([service.reset_peak_rss() for service in services])
+        summary = await run_level(concurrency, args.requests, request)
+        summary["peak_rss_mb"] = {service.name: service.peak_rss_mb() for service in services}
+        if not reset:
+            summary["peak_rss_cumulative"] = True
+        levels.append(summary)
+        print(f"  concurrency {concurrency:>4}: {summary['rps']} req/s, p50 {summary['p50_ms']} ms, "
+              f"p95 {summary['p95_ms']} ms, p99 {summary['p99_ms']} ms, {summary['errors']} errors", file=sys.stderr)
+    return levels
+
+async def bench_respond(args, workdir):
+    # One payload per request across warm-up and all levels, so the cache hit rate follows --repeat-ratio
+    items = text_corpus(args.warmup + args.requests * len(args.concurrency), args.seed, args.repeat_ratio)
+    sent = itertools.count()
+    with running(api_service(workdir, args)) as (api,):
+        limits = httpx.Limits(max_connections=max(args.concurrency), max_keepalive_connections=max(args.concurrency))
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{api.port}", limits=limits,
+                                     timeout=REQUEST_TIMEOUT) as http:
+            async def request(index):
+                response = await http.post("/api/respond", json=items[next(sent)])
+                return response.status_code == 200
+
+            levels = await run_levels(args, request, [api])
+            stats = (await http.get("/api/stats")).json()
+    return {"levels": levels, "decision_cache": stats.get("decision_cache")}
+
+async def recognize_session(uri, pcm, config):
+    """
+    Run one WebSocket session: config, audio frames, eof, then wait for the final transcription.
+
+    Returns:
+        bool: True if the session finished without an error message.
+    """
+    async with websockets.connect(uri, max_size=2 ** 20) as websocket:
+        async def receive():
+            ok = True
+            async for message in websocket:
+                response = json.loads(message)
+                if "error" in response:
+                    ok = False
+                if response.get("status") == "Final transcription":
+                    return ok
+            return False
+
+        receiver = asyncio.create_task(receive())
+        try:
+            await websocket.send(json.dumps({"config": config}))
+            for offset in range(0, len(pcm), WS_FRAME_BYTES):
+                await websocket.send(pcm[offset:offset + WS_FRAME_BYTES])
+            await websocket.send(json.dumps({"eof": 1}))
+            return await receiver
+        finally:
+            receiver.cancel()
+
+def session_config(args):
+    config = {"vad": args.vad}
+    if not args.ffmpeg:
+        config["encoding"] = f"pcm_s16le@{SAMPLE_RATE}"
+    return config
+
+async def bench_recognize(args, workdir, clips):
+    extension = "wav" if args.ffmpeg else "raw"
+    audio = []
+    for clip in clips:
+        with open(os.path.join(workdir, "corpus", f"{clip}.{extension}"), "rb") as f:
+            audio.append(f.read())
+    config = session_config(args)
+    with running(vosk_service(workdir, args)) as (vosk,):
+        uri = f"ws://127.0.0.1:{vosk.port}"
+
+        async def request(index):
+            return await recognize_session(uri, audio[index % len(audio)], config)
+
+        levels = await run_levels(args, request, [vosk])
+    return {"levels": levels}
+
+async def bench_transcribe(args, workdir, clips):
+    # client.py only fetches .mp3 and .wav URLs; without --ffmpeg the WAV header is decoded as a few samples of PCM
+    config = session_config(args)
+    vosk = vosk_service(workdir, args)
+    with static_files(os.path.join(workdir, "corpus")) as base_url, running(vosk) as _:
+        with running(client_service(workdir, args, vosk.port)) as (client,):
+            limits = httpx.Limits(max_connections=max(args.concurrency))
+            async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{client.port}", limits=limits,
+                                         timeout=REQUEST_TIMEOUT) as http:
+                async def request(index):
+                    url = f"{base_url}/{clips[index % len(clips)]}.wav"
+                    response = await http.post("/transcribe", json={"url": url, "config": config})
+                    if response.status_code != 200 or response.json().get("errors"):
+                        raise RuntimeError(f"{response.status_code}: {response.text[:200]}")
+                    return True
+
+                levels = await run_levels(args, request, [client, vosk])
+    return {"levels": levels}
+
+def compare(results, baseline):
+    """
+    Print throughput and p95 changes against an earlier run to stderr.
+    """
+    for service, result in results.items():
+        before = {level["concurrency"]: level for level in baseline.get("results", {}).get(service, {}).get("levels", [])}
+        for level in result["levels"]:
+            old = before.get(level["concurrency"])
+            if not old or not old.get("rps") or not old.get("p95_ms") or not level.get("rps"):
+                continue
+            print(f"{service} @ {level['concurrency']}: rps {old['rps']} -> {level['rps']} "
+                  f"({(level['rps'] / old['rps'] - 1) * 100:+.1f}%), p95 {old['p95_ms']} -> {level['p95_ms']} ms "
+                  f"({(level['p95_ms'] / old['p95_ms'] - 1) * 100:+.1f}%)", file=sys.stderr)
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIRECTORY, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmark for api.py, vosk_server.py and client.py")
+    parser.add_argument("services", nargs="*", metavar="service",
+                        help=f"Services to benchmark: {', '.join(SERVICES)} (default: all)")
+    parser.add_argument("--concurrency", default="1,8,32", help="Comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=300, help="Requests per concurrency level")
+    parser.add_argument("--warmup", type=int, default=20, help="Unrecorded requests before the first level")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--repeat-ratio", type=float, default=0.3, help="Share of redialled /api/respond payloads")
+    parser.add_argument("--no-decision-cache", action="store_true", help="Run api.py with DECISION_CACHE_ENABLED=0")
+    parser.add_argument("--clip-seconds", type=float, default=6.0, help="Length of each generated audio clip")
+    parser.add_argument("--ffmpeg", action="store_true", help="Send WAV through ffmpeg instead of raw PCM")
+    parser.add_argument("--vad", action="store_true", help="Enable voice activity detection in the sessions")
+    parser.add_argument("--log-level", default="INFO", help="LOG_LEVEL for vosk_server.py and client.py")
+    parser.add_argument("--output", help="Also write the JSON results to this file")
+    parser.add_argument("--compare", help="Earlier JSON results to compare against")
+    args = parser.parse_args(argv)
+    unknown = set(args.services) - set(SERVICES)
+    if unknown:
+        parser.error(f"unknown service(s): {', '.join(sorted(unknown))}")
+    args.services = args.services or list(SERVICES)
+    args.concurrency = [int(level) for level in args.concurrency.split(",") if level.strip()]
+    return args
+
+async def main(argv=None):
+    args = parse_args(argv)
+    report = {
+        "meta": {
+            "started": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "concurrency": args.concurrency,
+            "requests": args.requests,
+            "seed": args.seed,
+            "clip_seconds": args.clip_seconds,
+            "ffmpeg": args.ffmpeg,
+            "vad": args.vad,
+            "decision_cache": not args.no_decision_cache
+        },
+        "results": {}
+    }
+    with tempfile.TemporaryDirectory(prefix="vmm-bench-") as workdir:
+        os.makedirs(os.path.join(workdir, "corpus"))
+        clips = audio_corpus(os.path.join(workdir, "corpus"), args.clip_seconds, args.seed)
+        for service in args.services:
+            print(f"{service}:", file=sys.stderr)
+            if service == "respond":
+                report["results"][service] = await bench_respond(args, workdir)
+            elif service == "recognize":
+                report["results"][service] = await bench_recognize(args, workdir, clips)
+            else:
+                report["results"][service] = await bench_transcribe(args, workdir, clips)
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    if args.compare:
+        with open(args.compare, "r") as f:
+            compare(report["results"], json.load(f))
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,181 +1,880 @@
-import asyncio
-import websockets
-import json
-import logging
-import os
-import httpx
-from fastapi import FastAPI, HTTPException, Request
-from fastapi.responses import JSONResponse
-from pydub import AudioSegment
-import io
-import time
-from urllib.parse import urlparse
-
-# Configure logging
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
-logger = logging.getLogger(__name__)
-
-app = FastAPI(title="Vosk WebSocket Client API")
-
-async def download_audio(url: str) -> tuple[bytes, str, str]:
-    """
-    Download audio file from the given URL.
-
-    Args:
-        url: URL to the audio file.
-
-    Returns:
-        Tuple of (audio data as bytes, filename, error message if any).
-    """
-    try:
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.get(url)
-            response.raise_for_status()
-            audio_data = response.content
-            filename = os.path.basename(urlparse(url).path)
-            file_extension = os.path.splitext(filename)[1].lower()
-            if file_extension not in ['.mp3', '.wav']:
-                return None, filename, f"Unsupported file format: {file_extension}"
-            logger.debug(f"Downloaded audio from {url}, size: {len(audio_data)} bytes")
-            return audio_data, filename, None
-    except httpx.HTTPStatusError as e:
-        logger.error(f"HTTP error downloading audio: {e}")
-        return None, "", f"HTTP error downloading audio: {str(e)}"
-    except httpx.RequestError as e:
-        logger.error(f"Request error downloading audio: {e}")
-        return None, "", f"Request error downloading audio: {str(e)}"
-    except Exception as e:
-        logger.error(f"Unexpected error downloading audio: {e}")
-        return None, "", f"Unexpected error downloading audio: {str(e)}"
-
-async def send_audio_to_websocket(audio_data: bytes, filename: str, config: dict = None) -> dict:
-    """
-    Send audio data to the WebSocket server in chunks and collect transcription results.
-
-    Args:
-        audio_data: Raw audio data as bytes.
-        filename: Name of the audio file (used to determine format).
-        config: Optional configuration dictionary for the recognizer.
-
-    Returns:
-        Dictionary containing concatenated transcription, errors, and status.
-    """
-    uri = "ws://localhost:2700"
-    result = {"transcription": "", "errors": [], "status": "incomplete"}
-    transcription_parts = []  # Collect all transcription parts
-    try:
-        async with websockets.connect(uri, ping_interval=30, ping_timeout=300, close_timeout=30, max_size=52_428_800) as websocket:
-            logger.info(f"Connected to WebSocket server at {uri}")
-
-            # Send configuration if provided
-            if config:
-                await websocket.send(json.dumps({"config": config}))
-                logger.debug(f"Sent config: {config}")
-
-            # Send filename
-            await websocket.send(json.dumps({"filename": filename}))
-            logger.debug(f"Sent filename: {filename}")
-
-            # Send audio data in chunks
-            chunk_size = 1_000_000  # 1 MB chunks
-            for i in range(0, len(audio_data), chunk_size):
-                chunk = audio_data[i:i + chunk_size]
-                await websocket.send(chunk)
-                await websocket.send(json.dumps({"chunk": i // chunk_size + 1}))
-                logger.debug(f"Sent audio chunk {i // chunk_size + 1}, size: {len(chunk)} bytes")
-                await asyncio.sleep(0.1)  # Small delay to prevent overwhelming the server
-
-            # Send EOF to signal end of audio
-            await websocket.send(json.dumps({"eof": 1}))
-            logger.debug("Sent EOF")
-
-            # Receive responses
-            while True:
-                try:
-                    message = await asyncio.wait_for(websocket.recv(), timeout=300.0)
-                    logger.debug(f"Received message: {message}")
-                    response = json.loads(message)
-
-                    if "error" in response:
-                        result["errors"].append(response["error"])
-                        logger.error(f"Server error: {response['error']}")
-                    elif "status" in response:
-                        logger.info(f"Server status: {response['status']}")
-                    elif "partial" in response:
-                        transcription_parts.append(response["partial"])
-                        logger.debug(f"Partial transcription: {response['partial']}")
-                    elif "text" in response:
-                        transcription_parts.append(response["text"])
-                        logger.info(f"Final transcription: {response['text']}")
-                        result["status"] = "complete"
-
-                    # Check for final transcription
-                    if response.get("status") == "Final transcription":
-                        break
-
-                except asyncio.TimeoutError:
-                    logger.warning("WebSocket receive timeout")
-                    result["errors"].append("WebSocket receive timeout")
-                    await websocket.send(json.dumps({"status": "Keepalive"}))
-                    continue
-                except websockets.exceptions.ConnectionClosedError as e:
-                    logger.warning(f"WebSocket connection closed: {e}")
-                    result["errors"].append(f"WebSocket connection closed: {str(e)}")
-                    break
-                except json.JSONDecodeError as e:
-                    logger.error(f"Invalid JSON received: {e}")
-                    result["errors"].append(f"Invalid JSON received: {str(e)}")
-                    break
-
-    except Exception as e:
-        logger.error(f"WebSocket connection error: {e}")
-        result["errors"].append(f"WebSocket connection error: {str(e)}")
-        result["status"] = "failed"
-
-    # Concatenate all transcription parts into a single string
-    result["transcription"] = " ".join(part for part in transcription_parts if part).strip()
-
-    return result
-
-@app.post("/transcribe")
-async def transcribe_audio(request: Request):
-    """
-    HTTP endpoint to transcribe audio from a URL via WebSocket server.
-
-    Args:
-        request: JSON payload with `url` and optional `config`.
-
-    Returns:
-        JSON response with concatenated transcription, errors, status, and processing time.
-    """
-    try:
-        # Parse JSON payload
-        data = await request.json()
-        url = data.get("url")
-        config = data.get("config")
-
-        # Validate inputs
-        if not url:
-            raise HTTPException(status_code=400, detail="Missing url field")
-
-        # Download audio
-        start_time = time.time()
-        audio_data, filename, error = await download_audio(url)
-        if error:
-            raise HTTPException(status_code=400, detail=error)
-
-        # Send to WebSocket server
-        result = await send_audio_to_websocket(audio_data, filename, config)
-        result["processing_time"] = time.time() - start_time
-
-        return JSONResponse(content=result)
-
-    except json.JSONDecodeError:
-        raise HTTPException(status_code=400, detail="Invalid JSON payload")
-    except Exception as e:
-        logger.error(f"Error processing request: {e}")
-        raise HTTPException(status_code=500, detail=f"Error processing request: {str(e)}")
-
-if __name__ == "__main__":
-    import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+import asyncio
+import hashlib
+import importlib.util
+import websockets
+import json
+import logging
+import math
+import os
+import random
+import httpx
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse
+from pydub import AudioSegment
+import io
+import time
+from collections.abc import AsyncIterable
+from contextlib import asynccontextmanager
+from urllib.parse import urlparse
+from transcription_cache import TRANSCRIPTION_CACHE_PREFETCH_BYTES, depends_on_keywords, get_transcription_cache
+from keywords import get_matcher, start_watcher
+
+# Configure logging (LOG_LEVEL=INFO quiets the per-frame messages)
+logging.basicConfig(level=os.environ.get("LOG_LEVEL", "DEBUG"), format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Recognizer connection settings (overridable through the environment)
+VOSK_SERVER_URI = os.environ.get("VOSK_SERVER_URI", "ws://localhost:2700")
+# Comma-separated recognizer servers; sessions are spread across them
+VOSK_BACKENDS = [uri.strip() for uri in os.environ.get("VOSK_BACKENDS", VOSK_SERVER_URI).split(",") if uri.strip()]
+VOSK_HEALTH_INTERVAL = float(os.environ.get("VOSK_HEALTH_INTERVAL", "5"))  # Seconds between health checks
+VOSK_HEALTH_TIMEOUT = float(os.environ.get("VOSK_HEALTH_TIMEOUT", "2"))
+VOSK_EJECT_AFTER = int(os.environ.get("VOSK_EJECT_AFTER", "2"))  # Consecutive failures before a backend is ejected
+VOSK_MAX_ATTEMPTS = int(os.environ.get("VOSK_MAX_ATTEMPTS", "2"))  # Backends tried per transcription
+VOSK_RETRY_BUFFER = int(os.environ.get("VOSK_RETRY_BUFFER", "1048576"))  # Streamed audio kept for a retry
+WS_POOL_SIZE = int(os.environ.get("WS_POOL_SIZE", "4"))
+WS_SESSIONS_PER_CONNECTION = int(os.environ.get("WS_SESSIONS_PER_CONNECTION", "8"))
+WS_SEND_WINDOW = int(os.environ.get("WS_SEND_WINDOW", "4"))  # Unacknowledged audio frames per session
+WS_CONTROL_MESSAGES = 4  # Inbox room a session needs besides audio: config, filename, EOF and cancel
+WS_CHUNK_SIZE = int(os.environ.get("WS_CHUNK_SIZE", "65536"))  # Audio bytes per frame
+WS_MAX_MESSAGE_SIZE = 1_048_576  # Replies are small JSON messages
+
+# Audio download client settings; most URLs point at the same Flask host, so connections are kept alive
+HTTP_TIMEOUT = float(os.environ.get("HTTP_TIMEOUT", "30"))
+HTTP_MAX_CONNECTIONS = int(os.environ.get("HTTP_MAX_CONNECTIONS", "20"))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get("HTTP_MAX_KEEPALIVE_CONNECTIONS", "10"))
+HTTP_KEEPALIVE_EXPIRY = float(os.environ.get("HTTP_KEEPALIVE_EXPIRY", "30"))
+HTTP2_ENABLED = os.environ.get("HTTP2_ENABLED", "0") == "1"  # Needs the h2 package
+
+# Admission control for /transcribe
+TRANSCRIBE_CONCURRENCY = int(os.environ.get("TRANSCRIBE_CONCURRENCY", "4"))  # Match the server's VOSK_POOL_SIZE
+TRANSCRIBE_QUEUE_DEPTH = int(os.environ.get("TRANSCRIBE_QUEUE_DEPTH", "32"))
+TRANSCRIBE_DEADLINE = float(os.environ.get("TRANSCRIBE_DEADLINE", "120"))  # Seconds from arrival, queueing included
+
+class MultiplexSession:
+    """
+    One transcription session on a shared WebSocket connection.
+
+    Outgoing messages are tagged with the session ID. Audio frames are flow-controlled
+    by a window of unacknowledged frames that the server's acks reopen.
+    """
+
+    def __init__(self, connection: "MultiplexConnection", session_id: int, window: int):
+        self.connection = connection
+        self.session_id = session_id
+        self.messages = asyncio.Queue()
+        self._window = asyncio.Semaphore(window)
+
+    async def send_json(self, payload: dict):
+        await self.connection.websocket.send(json.dumps({"session": self.session_id, **payload}))
+
+    async def send_audio(self, chunk: bytes):
+        """
+        Send an audio frame, waiting while the session's send window is full.
+        """
+        await self._window.acquire()
+        if self.connection.closed:
+            raise websockets.exceptions.ConnectionClosedError(None, None)
+        await self.connection.websocket.send(self.session_id.to_bytes(4, "big") + chunk)
+
+    async def receive(self, timeout: float) -> dict:
+        """
+        Wait for the next message addressed to this session.
+
+        Raises:
+            asyncio.TimeoutError: If nothing arrives within `timeout` seconds.
+        """
+        return await asyncio.wait_for(self.messages.get(), timeout=timeout)
+
+    def _ack(self):
+        self._window.release()
+
+    def _fail(self, error: str):
+        self.messages.put_nowait({"error": error, "fatal": True, "retryable": True})
+        # Wake a sender blocked on the window so it sees the closed connection
+        self._window.release()
+
+    def close(self):
+        """
+        Detach the session from its connection so the slot can be reused.
+        """
+        self.connection.sessions.pop(self.session_id, None)
+
+class MultiplexConnection:
+    """
+    Long-lived WebSocket connection to vosk_server.py carrying several tagged sessions.
+    """
+
+    def __init__(self, uri: str):
+        self.uri = uri
+        self.websocket = None
+        self.sessions = {}
+        self.closed = False
+        self.window = WS_SEND_WINDOW
+        self._next_session_id = 1
+        self._reader = None
+
+    async def connect(self):
+        self.websocket = await websockets.connect(self.uri, ping_interval=30, ping_timeout=300, close_timeout=30, max_size=WS_MAX_MESSAGE_SIZE)
+        await self.websocket.send(json.dumps({"multiplex": 1}))
+        reply = json.loads(await asyncio.wait_for(self.websocket.recv(), timeout=30.0))
+        if reply.get("status") != "Multiplexing enabled":
+            await self.websocket.close()
+            raise RuntimeError(f"Server did not enable multiplexing: {reply}")
+        if "inbox" in reply:
+            # Keep each session within the server's per-session inbox, or the server fails it
+            self.window = max(1, min(WS_SEND_WINDOW, int(reply["inbox"]) - WS_CONTROL_MESSAGES))
+        self._reader = asyncio.create_task(self._read())
+        logger.info(f"Connected to WebSocket server at {self.uri}")
+
+    def open_session(self) -> MultiplexSession:
+        session = MultiplexSession(self, self._next_session_id, self.window)
+        self._next_session_id += 1
+        self.sessions[session.session_id] = session
+        return session
+
+    async def _read(self):
+        error = "WebSocket connection closed"
+        try:
+            async for message in self.websocket:
+                try:
+                    response = json.loads(message)
+                    session = self.sessions.get(response.pop("session", None))
+                except (json.JSONDecodeError, AttributeError, TypeError) as e:
+                    logger.error(f"Invalid JSON received: {e}")
+                    continue
+                if session is None:
+                    logger.debug(f"Dropping message for unknown session: {response}")
+                elif "ack" in response:
+                    session._ack()
+                else:
+                    session.messages.put_nowait(response)
+        except websockets.exceptions.ConnectionClosed as e:
+            error = f"WebSocket connection closed: {str(e)}"
+        finally:
+            self.closed = True
+            logger.warning(f"{error} ({self.uri})")
+            for session in list(self.sessions.values()):
+                session._fail(error)
+
+    async def close(self):
+        self.closed = True
+        if self.websocket is not None:
+            await self.websocket.close()
+        if self._reader is not None:
+            await asyncio.gather(self._reader, return_exceptions=True)
+
+class WebSocketPool:
+    """
+    Pool of multiplexed connections to one recognizer server.
+
+    New sessions go to the open connection with the fewest sessions. Another connection
+    is opened while all are at WS_SESSIONS_PER_CONNECTION, up to WS_POOL_SIZE; past
+    that, sessions share the least loaded connection.
+    """
+
+    def __init__(self, uri: str, size: int = WS_POOL_SIZE, sessions_per_connection: int = WS_SESSIONS_PER_CONNECTION):
+        self.uri = uri
+        self.size = size
+        self.sessions_per_connection = sessions_per_connection
+        self.connections = []
+        self._lock = asyncio.Lock()
+        self.connects = 0
+
+    async def open_session(self) -> MultiplexSession:
+        async with self._lock:
+            self.connections = [c for c in self.connections if not c.closed]
+            connection = min(self.connections, key=lambda c: len(c.sessions), default=None)
+            if connection is None or (len(connection.sessions) >= self.sessions_per_connection
+                                      and len(self.connections) < self.size):
+                connection = MultiplexConnection(self.uri)
+                await connection.connect()
+                self.connects += 1
+                self.connections.append(connection)
+            return connection.open_session()
+
+    async def close(self):
+        async with self._lock:
+            await asyncio.gather(*(c.close() for c in self.connections), return_exceptions=True)
+            self.connections = []
+
+    def stats(self) -> dict:
+        return {
+            "uri": self.uri,
+            "connections": len([c for c in self.connections if not c.closed]),
+            "sessions": sum(len(c.sessions) for c in self.connections if not c.closed),
+            "connects": self.connects
+        }
+
+# Download counters; a download that opens no connection reused a pooled one
+http_stats = {"downloads": 0, "active_downloads": 0, "connections_opened": 0, "http2": False}
+
+async def trace_download(event_name: str, info: dict):
+    if event_name == "connection.connect_tcp.complete":
+        http_stats["connections_opened"] += 1
+
+class Backend:
+    """
+    One recognizer server: its connection pool plus the load and health state used for routing.
+    """
+
+    def __init__(self, uri: str):
+        self.uri = uri
+        self.pool = WebSocketPool(uri)
+        self.outstanding = 0
+        self.failures = 0  # Consecutive failed sessions or health checks
+        self.ejections = 0
+        self.routed = 0  # Sessions sent to this backend, retries included
+        self.last_error = None
+
+    @property
+    def healthy(self) -> bool:
+        return self.failures < VOSK_EJECT_AFTER
+
+    def mark_success(self):
+        if not self.healthy:
+            logger.info(f"Backend {self.uri} is healthy again")
+        self.failures = 0
+
+    def mark_failure(self, error: str):
+        self.failures += 1
+        self.last_error = error
+        if self.failures == VOSK_EJECT_AFTER:
+            self.ejections += 1
+            logger.warning(f"Ejecting backend {self.uri} after {self.failures} failures: {error}")
+
+    async def check(self):
+        """
+        Health check: ping an open connection, or open one if there is none.
+        """
+        try:
+            connection = next((c for c in self.pool.connections if not c.closed), None)
+            if connection is not None:
+                pong = await connection.websocket.ping()
+                await asyncio.wait_for(pong, timeout=VOSK_HEALTH_TIMEOUT)
+            else:
+                connection = MultiplexConnection(self.uri)
+                try:
+                    await asyncio.wait_for(connection.connect(), timeout=VOSK_HEALTH_TIMEOUT)
+                finally:
+                    await connection.close()
+        except Exception as e:
+            self.mark_failure(f"Health check failed: {str(e) or type(e).__name__}")
+        else:
+            self.mark_success()
+
+    def stats(self) -> dict:
+        return {
+            **self.pool.stats(),
+            "healthy": self.healthy,
+            "outstanding": self.outstanding,
+            "routed": self.routed,
+            "failures": self.failures,
+            "ejections": self.ejections,
+            "last_error": self.last_error
+        }
+
+class RecognizerFleet:
+    """
+    The recognizer servers in VOSK_BACKENDS, with load balancing and health checks.
+
+    Sessions go to the less loaded of two random healthy backends (power of two
+    choices on outstanding sessions). A backend is ejected after VOSK_EJECT_AFTER
+    consecutive failures and readmitted when a periodic health check succeeds. If
+    every backend is ejected, sessions are still tried on them rather than refused.
+    """
+
+    def __init__(self, uris: list[str]):
+        self.backends = [Backend(uri) for uri in uris]
+        self._health_task = None
+
+    def pick(self, exclude: set = frozenset()) -> Backend:
+        """
+        Choose a backend for a new session, or None if all have been excluded.
+        """
+        candidates = [b for b in self.backends if b.uri not in exclude]
+        candidates = [b for b in candidates if b.healthy] or candidates
+        if len(candidates) <= 1:
+            return candidates[0] if candidates else None
+        first, second = random.sample(candidates, 2)
+        return first if first.outstanding <= second.outstanding else second
+
+    def start(self):
+        if self._health_task is None:
+            self._health_task = asyncio.create_task(self._check_health())
+
+    async def _check_health(self):
+        while True:
+            await asyncio.sleep(VOSK_HEALTH_INTERVAL)
+            await asyncio.gather(*(backend.check() for backend in self.backends))
+
+    async def close(self):
+        if self._health_task is not None:
+            self._health_task.cancel()
+            await asyncio.gather(self._health_task, return_exceptions=True)
+        await asyncio.gather(*(backend.pool.close() for backend in self.backends))
+
+    def stats(self) -> dict:
+        return {
+            "backends": [backend.stats() for backend in self.backends],
+            "healthy": sum(backend.healthy for backend in self.backends)
+        }
+
+class AdmissionController:
+    """
+    Bounded scheduler in front of the recognizer.
+
+    At most `limit` transcriptions run at once and at most `queue_depth` more wait for
+    a slot. A request arriving to a full queue is rejected at once with 429; one still
+    queued when its deadline passes gets 503, and one still running is cancelled with
+    504. Rejections carry a Retry-After estimated from recent service times.
+    """
+
+    def __init__(self, limit: int = TRANSCRIBE_CONCURRENCY, queue_depth: int = TRANSCRIBE_QUEUE_DEPTH,
+                 deadline: float = TRANSCRIBE_DEADLINE):
+        self.limit = limit
+        self.queue_depth = queue_depth
+        self.deadline = deadline
+        self._slots = asyncio.Semaphore(limit)
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.expired = 0
+        self.timed_out = 0
+        self.cancelled = 0
+        self.service_time = 1.0  # Moving average of seconds per transcription
+
+    def retry_after(self) -> str:
+        # Time for the requests ahead to drain through the slots
+        return str(max(1, math.ceil(self.service_time * (self.waiting + 1) / self.limit)))
+
+    async def run(self, work):
+        """
+        Run a coroutine once a slot is free, cancelling it if the deadline passes.
+
+        Raises:
+            HTTPException: 429 if the queue is full, 503 if no slot freed up before the
+                deadline, 504 if the work did not finish before the deadline.
+        """
+        loop = asyncio.get_running_loop()
+        arrived = loop.time()
+        if self._slots.locked() and self.waiting >= self.queue_depth:
+            work.close()
+            self.rejected += 1
+            raise HTTPException(status_code=429, detail="Too many transcription requests queued",
+                                headers={"Retry-After": self.retry_after()})
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._slots.acquire(), timeout=self.deadline)
+        except asyncio.TimeoutError:
+            work.close()
+            self.expired += 1
+            raise HTTPException(status_code=503, detail="No transcription slot freed up before the request deadline",
+                                headers={"Retry-After": self.retry_after()})
+        except asyncio.CancelledError:
+            work.close()
+            raise
+        finally:
+            self.waiting -= 1
+
+        self.active += 1
+        self.admitted += 1
+        started = loop.time()
+        try:
+            return await asyncio.wait_for(work, timeout=max(self.deadline - (started - arrived), 0.0))
+        except asyncio.TimeoutError:
+            self.timed_out += 1
+            raise HTTPException(status_code=504, detail="Transcription did not finish before the request deadline")
+        finally:
+            self.active -= 1
+            self._slots.release()
+            self.service_time = 0.8 * self.service_time + 0.2 * (loop.time() - started)
+
+    def stats(self) -> dict:
+        return {
+            "limit": self.limit,
+            "queue_depth": self.queue_depth,
+            "deadline": self.deadline,
+            "active": self.active,
+            "waiting": self.waiting,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "expired": self.expired,
+            "timed_out": self.timed_out,
+            "cancelled": self.cancelled,
+            "service_time": round(self.service_time, 3)
+        }
+
+def create_http_client() -> httpx.AsyncClient:
+    """
+    Create the application-wide HTTP client used for audio downloads.
+
+    HTTP/2 is only enabled when HTTP2_ENABLED is set and the h2 package is installed.
+    """
+    http2 = HTTP2_ENABLED
+    if http2 and importlib.util.find_spec("h2") is None:
+        logger.warning("HTTP2_ENABLED is set but the h2 package is not installed, using HTTP/1.1")
+        http2 = False
+    http_stats["http2"] = http2
+    limits = httpx.Limits(
+        max_connections=HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY
+    )
+    return httpx.AsyncClient(timeout=HTTP_TIMEOUT, limits=limits, http2=http2)
+
+fleet = None
+http_client = None
+admission = None
+transcription_cache = get_transcription_cache()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global fleet, http_client, admission
+    fleet = RecognizerFleet(VOSK_BACKENDS)
+    fleet.start()
+    # The keyword version is part of the cache key for early_decision and keyword-mode results
+    start_watcher()
+    http_client = create_http_client()
+    admission = AdmissionController()
+    yield
+    await http_client.aclose()
+    await fleet.close()
+
+app = FastAPI(title="Vosk WebSocket Client API", lifespan=lifespan)
+
+async def iter_chunks(audio_data: bytes, chunk_size: int = WS_CHUNK_SIZE):
+    """
+    Yield in-memory audio in WebSocket-sized chunks without copying it.
+    """
+    view = memoryview(audio_data)
+    for i in range(0, len(view), chunk_size):
+        yield view[i:i + chunk_size]
+
+class ReplayableAudio:
+    """
+    Audio source that can be sent again after a backend fails mid-session.
+
+    In-memory audio is simply re-chunked. A stream keeps what it has read, up to
+    VOSK_RETRY_BUFFER bytes, so a retry replays that and carries on with the rest of
+    the same stream instead of downloading it again. Past the limit the buffer is
+    dropped and the audio can no longer be retried.
+
+    Reads from the stream are shielded: cancelling a failed session's sender must not
+    cancel (and so end) the download that the retry carries on with.
+    """
+
+    def __init__(self, audio: bytes | AsyncIterable[bytes], limit: int = VOSK_RETRY_BUFFER):
+        self._data = audio if isinstance(audio, (bytes, bytearray)) else None
+        self._source = audio.__aiter__() if self._data is None else None
+        self._buffer = []
+        self._size = 0
+        self._pending = None
+        self.limit = limit
+        self.replayable = True
+
+    async def _read(self):
+        if self._pending is None:
+            self._pending = asyncio.ensure_future(self._source.__anext__())
+        chunk = await asyncio.shield(self._pending)
+        self._pending = None
+        return chunk
+
+    async def chunks(self):
+        if self._data is not None:
+            async for chunk in iter_chunks(self._data):
+                yield chunk
+            return
+        for chunk in list(self._buffer):
+            yield chunk
+        while True:
+            try:
+                chunk = await self._read()
+            except StopAsyncIteration:
+                return
+            if self.replayable:
+                self._buffer.append(chunk)
+                self._size += len(chunk)
+                if self._size > self.limit:
+                    self.replayable = False
+                    self._buffer = []
+            yield chunk
+
+    async def aclose(self):
+        """
+        Stop a read still in flight once no session needs the audio.
+        """
+        if self._pending is not None:
+            self._pending.cancel()
+            await asyncio.gather(self._pending, return_exceptions=True)
+            self._pending = None
+
+async def stream_audio(session: "MultiplexSession", audio_chunks: AsyncIterable[bytes]):
+    """
+    Forward audio chunks to a session as they arrive, then send EOF.
+
+    Failures are posted to the session's message queue as a fatal error, so the
+    receiving side stops waiting for results. Failures of the connection are also
+    marked retryable.
+    """
+    try:
+        count = 0
+        async for chunk in audio_chunks:
+            if chunk:
+                await session.send_audio(chunk)
+                count += 1
+                logger.debug(f"Sent audio chunk {count}, size: {len(chunk)} bytes")
+        await session.send_json({"eof": 1})
+        logger.debug("Sent EOF")
+    except asyncio.CancelledError:
+        raise
+    except httpx.HTTPError as e:
+        logger.error(f"Error downloading audio: {e}")
+        session.messages.put_nowait({"error": f"Error downloading audio: {str(e)}", "fatal": True})
+    except websockets.exceptions.ConnectionClosed as e:
+        logger.error(f"Error sending audio: {e}")
+        session.messages.put_nowait({"error": f"Error sending audio: {str(e)}", "fatal": True, "retryable": True})
+    except Exception as e:
+        logger.error(f"Error sending audio: {e}")
+        session.messages.put_nowait({"error": f"Error sending audio: {str(e)}", "fatal": True})
+
+async def send_audio_to_websocket(audio: bytes | AsyncIterable[bytes], filename: str, config: dict = None) -> dict:
+    """
+    Transcribe audio on one of the recognizer backends, retrying on another if it fails.
+
+    A backend failure (connection refused or lost, or no free recognizer) is retried
+    on a different backend, up to VOSK_MAX_ATTEMPTS backends, as long as the audio
+    can still be replayed.
+
+    Args:
+        audio: Audio data as bytes, or an async iterator of chunks (e.g. a download in progress).
+        filename: Name of the audio file (used to determine format).
+        config: Optional configuration dictionary for the recognizer.
+
+    Returns:
+        Dictionary containing concatenated transcription, errors, status, the backend
+        that served it, and the early decision if the config asked for one.
+    """
+    source = ReplayableAudio(audio)
+    tried = set()
+    try:
+        while True:
+            backend = fleet.pick(exclude=tried)
+            tried.add(backend.uri)
+            backend.outstanding += 1
+            backend.routed += 1
+            try:
+                result, failure = await transcribe_on_backend(backend, source.chunks(), filename, config)
+            finally:
+                backend.outstanding -= 1
+            result["backend"] = backend.uri
+            result["attempts"] = len(tried)
+            if failure is None:
+                backend.mark_success()
+                return result
+            backend.mark_failure(failure)
+            if len(tried) >= min(VOSK_MAX_ATTEMPTS, len(fleet.backends)) or not source.replayable:
+                return result
+            logger.warning(f"Backend {backend.uri} failed ({failure}), retrying on another backend")
+    finally:
+        await source.aclose()
+
+async def transcribe_on_backend(backend: Backend, audio_chunks: AsyncIterable[bytes], filename: str,
+                                config: dict = None) -> tuple[dict, str]:
+    """
+    Stream audio to one backend and collect transcription results.
+
+    The session runs on a pooled, multiplexed connection. Audio is sent by a separate
+    task while results are read here, so recognition runs while the audio is still
+    arriving. The server's acknowledgements bound the audio in flight to WS_SEND_WINDOW
+    chunks, and an early decision stops the upload.
+
+    Returns:
+        Tuple of (result dictionary, error message if the backend itself failed and the
+        session may succeed elsewhere).
+    """
+    result = {"transcription": "", "errors": [], "status": "incomplete"}
+    transcription_parts = []  # Collect final transcription parts
+    decision_transcript = ""  # What the server had heard when it decided early
+    session = None
+    sender = None
+    finished = False
+    failure = None
+    try:
+        session = await backend.pool.open_session()
+
+        # Send configuration if provided
+        if config:
+            await session.send_json({"config": config})
+            logger.debug(f"Sent config: {config}")
+
+        # Send filename
+        await session.send_json({"filename": filename})
+        logger.debug(f"Sent filename: {filename}")
+
+        # Stream the audio, at most WS_SEND_WINDOW unacknowledged chunks at a time
+        sender = asyncio.create_task(stream_audio(session, audio_chunks))
+
+        # Receive responses
+        while True:
+            try:
+                response = await session.receive(timeout=300.0)
+                logger.debug(f"Received message: {response}")
+
+                if "decision" in response:
+                    # Early voicemail/honeypot decision from streaming partial results
+                    result["decision"] = response["decision"]
+                    decision_transcript = response.get("transcript") or decision_transcript
+                    logger.info(f"Early decision: {response['decision']}")
+                    if not sender.done():
+                        # The server decodes nothing after a decision: stop the upload and finish
+                        sender.cancel()
+                        await asyncio.gather(sender, return_exceptions=True)
+                        await session.send_json({"eof": 1})
+
+                if "error" in response:
+                    result["errors"].append(response["error"])
+                    logger.error(f"Server error: {response['error']}")
+                    if response.get("retryable") or response.get("status") == "Server busy":
+                        failure = response["error"]
+                        break
+                    if response.get("fatal"):
+                        break
+                elif "event" in response:
+                    # Acoustic events such as answering-machine beeps
+                    result.setdefault("events", []).append(response)
+                    logger.info(f"Server event: {response}")
+                elif "partial" in response:
+                    logger.debug(f"Partial transcription: {response['partial']}")
+                elif "text" in response:
+                    transcription_parts.append(response["text"])
+                    logger.info(f"Final transcription: {response['text']}")
+                    result["status"] = "complete"
+                elif "status" in response:
+                    logger.info(f"Server status: {response['status']}")
+
+                # Check for final transcription
+                if response.get("status") == "Final transcription":
+                    finished = True
+                    break
+
+            except asyncio.TimeoutError:
+                logger.warning("WebSocket receive timeout")
+                result["errors"].append("WebSocket receive timeout")
+                failure = "WebSocket receive timeout"
+                break
+
+    except Exception as e:
+        logger.error(f"WebSocket connection error: {e}")
+        result["errors"].append(f"WebSocket connection error: {str(e)}")
+        result["status"] = "failed"
+        failure = f"WebSocket connection error: {str(e)}"
+    finally:
+        if sender is not None and not sender.done():
+            sender.cancel()
+            await asyncio.gather(sender, return_exceptions=True)
+        if session is not None:
+            if not finished and not session.connection.closed:
+                # Stop the server decoding audio nobody is waiting for
+                try:
+                    await session.send_json({"cancel": 1})
+                except Exception:
+                    pass
+            session.close()
+
+    # Concatenate all transcription parts into a single string
+    result["transcription"] = " ".join(part for part in transcription_parts if part).strip()
+    if not result["transcription"]:
+        # Decided from a partial result before any utterance was finalized
+        result["transcription"] = decision_transcript.strip()
+
+    return result, failure
+
+async def hash_chunks(chunks: AsyncIterable[bytes], hasher, state: dict):
+    """
+    Pass chunks through while hashing them; state["complete"] is set once the stream is exhausted.
+    """
+    async for chunk in chunks:
+        hasher.update(chunk)
+        yield chunk
+    state["complete"] = True
+
+def transcription_key(cache, content_hash: str, config: dict = None) -> str:
+    """
+    Build the transcription cache key, including the keyword version when the result depends on it.
+    """
+    version = get_matcher().version if depends_on_keywords(config) else None
+    return cache.key(content_hash, config, version)
+
+async def transcribe_url(url: str, config: dict = None) -> tuple[dict, str]:
+    """
+    Transcribe audio from the given URL, serving repeated audio from the transcription cache.
+
+    A URL whose result is cached is revalidated with a conditional GET, and a 304 is
+    answered from the cache without downloading. Small files are downloaded and hashed
+    first, so the same audio behind a new URL is also a cache hit. Larger files are never
+    held in memory as a whole: chunks go to the WebSocket session as they are downloaded
+    and are hashed on the way, so recognition starts with the first bytes and memory per
+    request stays bounded whatever the file size.
+
+    Args:
+        url: URL to the audio file.
+        config: Optional configuration dictionary for the recognizer.
+
+    Returns:
+        Tuple of (transcription result, error message if the download could not start).
+    """
+    filename = os.path.basename(urlparse(url).path)
+    file_extension = os.path.splitext(filename)[1].lower()
+    if file_extension not in ['.mp3', '.wav']:
+        return None, f"Unsupported file format: {file_extension}"
+
+    cache = transcription_cache
+    headers = {}
+    validators = cache.url_validators(url) if cache is not None else None
+    cached_key = cached = cached_tier = None
+    if validators is not None:
+        cached_key = transcription_key(cache, validators["content_hash"], config)
+        cached, cached_tier = cache.peek(cached_key)
+        if cached is not None:
+            if validators["etag"]:
+                headers["If-None-Match"] = validators["etag"]
+            if validators["last_modified"]:
+                headers["If-Modified-Since"] = validators["last_modified"]
+
+    http_stats["downloads"] += 1
+    http_stats["active_downloads"] += 1
+    try:
+        # Shared client: connections to the audio host are reused across requests
+        async with http_client.stream("GET", url, headers=headers, extensions={"trace": trace_download}) as response:
+            etag = response.headers.get("etag")
+            last_modified = response.headers.get("last-modified")
+            if cached is not None and (response.status_code == 304 or (etag and etag == validators["etag"])):
+                # Unchanged since the cached transcription; the body is never read
+                cache.record_hit(cached_key, cached)
+                cached["cache"] = cache.metadata("hit", cached_tier)
+                logger.info(f"Transcription cache hit for {url} (revalidated)")
+                return cached, None
+            response.raise_for_status()
+            logger.debug(f"Downloading audio from {url} over {response.http_version}, size: {response.headers.get('content-length', 'unknown')} bytes")
+            if cache is None:
+                # Errors after this point are reported in the result's errors
+                return await send_audio_to_websocket(response.aiter_bytes(WS_CHUNK_SIZE), filename, config), None
+
+            content_length = int(response.headers.get("content-length") or 0)
+            if 0 < content_length <= TRANSCRIPTION_CACHE_PREFETCH_BYTES:
+                audio_data = await response.aread()
+                content_hash = hashlib.sha256(audio_data).hexdigest()
+                key = transcription_key(cache, content_hash, config)
+                cache.remember_url(url, etag, last_modified, content_hash)
+                result, tier = cache.get(key)
+                if result is not None:
+                    result["cache"] = cache.metadata("hit", tier)
+                    logger.info(f"Transcription cache hit for {url} ({tier})")
+                    return result, None
+                result = await send_audio_to_websocket(audio_data, filename, config)
+            else:
+                hasher = hashlib.sha256()
+                state = {"complete": False}
+                cache.record_miss()
+                result = await send_audio_to_websocket(hash_chunks(response.aiter_bytes(WS_CHUNK_SIZE), hasher, state), filename, config)
+                # An early decision stops the download, and a partial hash identifies nothing
+                content_hash = hasher.hexdigest() if state["complete"] else None
+                key = transcription_key(cache, content_hash, config) if content_hash else None
+
+            if key is not None and result["status"] == "complete" and not result["errors"]:
+                cache.put(key, result)
+                cache.remember_url(url, etag, last_modified, content_hash)
+            result["cache"] = cache.metadata("miss")
+            return result, None
+    except httpx.HTTPStatusError as e:
+        logger.error(f"HTTP error downloading audio: {e}")
+        return None, f"HTTP error downloading audio: {str(e)}"
+    except httpx.RequestError as e:
+        logger.error(f"Request error downloading audio: {e}")
+        return None, f"Request error downloading audio: {str(e)}"
+    finally:
+        http_stats["active_downloads"] -= 1
+
+async def wait_for_disconnect(request: Request):
+    """
+    Return once the HTTP client has gone away.
+    """
+    while True:
+        message = await request.receive()
+        if message["type"] == "http.disconnect":
+            return
+
+@app.post("/transcribe")
+async def transcribe_audio(request: Request):
+    """
+    HTTP endpoint to transcribe audio from a URL via WebSocket server.
+
+    Args:
+        request: JSON payload with `url` and optional `config`.
+
+    Returns:
+        JSON response with concatenated transcription, errors, status, and processing time.
+    """
+    try:
+        # Parse JSON payload
+        data = await request.json()
+        url = data.get("url")
+        config = data.get("config")
+
+        # Validate inputs
+        if not url:
+            raise HTTPException(status_code=400, detail="Missing url field")
+
+        # Stream the download to the WebSocket server once admitted, giving up if the client leaves
+        start_time = time.time()
+        work = asyncio.create_task(admission.run(transcribe_url(url, config)))
+        disconnect = asyncio.create_task(wait_for_disconnect(request))
+        await asyncio.wait([work, disconnect], return_when=asyncio.FIRST_COMPLETED)
+        disconnect.cancel()
+        if not work.done():
+            # Cancelling the work cancels the recognizer session and frees its slot
+            work.cancel()
+            await asyncio.gather(work, return_exceptions=True)
+            admission.cancelled += 1
+            logger.info(f"Client disconnected, cancelled transcription of {url}")
+            return JSONResponse(status_code=499, content={"detail": "Client closed request"})
+        result, error = work.result()
+        if error:
+            raise HTTPException(status_code=400, detail=error)
+        result["processing_time"] = time.time() - start_time
+
+        return JSONResponse(content=result)
+
+    except HTTPException:
+        raise
+    except json.JSONDecodeError:
+        raise HTTPException(status_code=400, detail="Invalid JSON payload")
+    except Exception as e:
+        logger.error(f"Error processing request: {e}")
+        raise HTTPException(status_code=500, detail=f"Error processing request: {str(e)}")
+
+@app.get("/stats")
+async def get_stats():
+    """
+    Report audio download, recognizer connection pool, admission and transcription cache statistics.
+    """
+    return {
+        "http": {
+            **http_stats,
+            "connections_reused": max(http_stats["downloads"] - http_stats["connections_opened"], 0),
+            "limits": {
+                "max_connections": HTTP_MAX_CONNECTIONS,
+                "max_keepalive_connections": HTTP_MAX_KEEPALIVE_CONNECTIONS,
+                "keepalive_expiry": HTTP_KEEPALIVE_EXPIRY
+            }
+        },
+        "websocket": fleet.stats(),
+        "admission": admission.stats(),
+        "transcription_cache": transcription_cache.stats() if transcription_cache is not None else None
+    }
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,131 @@
+"""
+Per-caller cache of /api/respond decisions.
+
+The same number redialled with the same greeting gets the same answer, so responses
+are cached under the phone number plus a fingerprint of the text and returned
+without classifying again. Entries expire after DECISION_CACHE_TTL seconds and the
+least recently used are evicted beyond DECISION_CACHE_MAX_ENTRIES.
+
+Responses depend on the keyword set and the default audio file, so the caller
+passes both with every lookup as the cache's epoch; when the epoch changes the
+whole cache is dropped. Each API worker process keeps its own cache.
+"""
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+DECISION_CACHE_ENABLED = os.environ.get("DECISION_CACHE_ENABLED", "1") == "1"
+DECISION_CACHE_MAX_ENTRIES = int(os.environ.get("DECISION_CACHE_MAX_ENTRIES", "100000"))
+DECISION_CACHE_TTL = float(os.environ.get("DECISION_CACHE_TTL", "3600"))
+
+def text_fingerprint(text):
+    """
+    Return a digest of the text as the keyword matcher sees it.
+
+    Only case is normalized: the matcher ignores it, while whitespace and punctuation can
+    decide whether a phrase matches and shift the match offsets in the response.
+    """
+    return hashlib.sha1((text or "").lower().encode("utf-8")).hexdigest()
+
+class DecisionCache:
+    """
+    Thread-safe LRU cache of response dicts with a per-entry TTL.
+    """
+
+    def __init__(self, max_entries=DECISION_CACHE_MAX_ENTRIES, ttl=DECISION_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # (phone number, fingerprint) -> (expiry, response), least recently used first
+        self._epoch = None
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def key(phone_number, text):
+        """
+        Build the cache key for a caller and the text they were classified on.
+        """
+        return phone_number, text_fingerprint(text)
+
+    def _check_epoch(self, epoch):
+        if epoch != self._epoch:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self._epoch = epoch
+
+    def get(self, key, epoch):
+        """
+        Look up a cached response.
+
+        Args:
+            key (tuple): Key from key().
+            epoch (tuple): Keyword version and default audio the response must have been built with.
+
+        Returns:
+            dict: Copy of the cached response, or None on a miss.
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._check_epoch(epoch)
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry[0] <= now:
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return dict(entry[1])
+
+    def put(self, key, epoch, response):
+        """
+        Cache a response built under the given epoch.
+        """
+        with self._lock:
+            self._check_epoch(epoch)
+            self._entries[key] = (time.monotonic() + self.ttl, dict(response))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        """
+        Report the entry count, hit rate and hit, miss, expiry, eviction and invalidation counters.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "expirations": self.expirations,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations
+            }
+
+_decision_cache = None
+_decision_cache_lock = threading.Lock()
+
+def get_decision_cache():
+    """
+    Return the process-wide decision cache, or None if it is disabled.
+    """
+    global _decision_cache
+    with _decision_cache_lock:
+        if DECISION_CACHE_ENABLED and _decision_cache is None:
+            _decision_cache = DecisionCache()
+        return _decision_cache
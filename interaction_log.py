@@ -0,0 +1,279 @@
+"""
+Asynchronous interaction logging for /api/respond.
+
+Request threads only put a row on a bounded in-memory queue. A background writer
+drains the queue into multi-row INSERTs over pooled connections, flushing when a
+batch fills up or FLUSH_INTERVAL passes. If the database is unreachable the batch
+is appended to a local spool file and replayed once writes succeed again. Spool
+lines that cannot be parsed are moved to `<spool>.bad` instead of blocking the replay.
+The process-wide logger flushes its queue when the interpreter exits.
+
+The connection factory is injected, so the pipeline runs against MySQL in production
+and against SQLite locally:
+
+    logger = InteractionLogger(lambda: sqlite3.connect("log.db", check_same_thread=False),
+                               paramstyle="qmark")
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+INTERACTION_LOG_ENABLED = os.environ.get("INTERACTION_LOG_ENABLED", "0") == "1"
+QUEUE_SIZE = int(os.environ.get("INTERACTION_LOG_QUEUE_SIZE", "10000"))
+BATCH_SIZE = int(os.environ.get("INTERACTION_LOG_BATCH_SIZE", "200"))
+FLUSH_INTERVAL = float(os.environ.get("INTERACTION_LOG_FLUSH_INTERVAL", "1"))
+POOL_SIZE = int(os.environ.get("INTERACTION_LOG_POOL_SIZE", "2"))
+SPOOL_PATH = os.environ.get("INTERACTION_LOG_SPOOL", "interaction_spool.jsonl")
+
+COLUMNS = ("uuid", "phone_number", "text", "response", "transfer", "end", "timestamp")
+PLACEHOLDERS = {"format": "%s", "qmark": "?"}
+
+class ConnectionPool:
+    """
+    Small pool of reusable database connections for the writer thread.
+    """
+
+    def __init__(self, connect, size=POOL_SIZE):
+        self._connect = connect
+        self.size = size
+        self._idle = queue.LifoQueue()
+
+    def get(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return self._connect()
+
+    def put(self, conn):
+        if self._idle.qsize() < self.size:
+            self._idle.put(conn)
+        else:
+            self.discard(conn)
+
+    def discard(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def close(self):
+        while True:
+            try:
+                self.discard(self._idle.get_nowait())
+            except queue.Empty:
+                return
+
+class InteractionLogger:
+    """
+    Bounded queue plus background batch writer for the interactions table.
+    """
+
+    def __init__(self, connect, paramstyle="format", queue_size=QUEUE_SIZE, batch_size=BATCH_SIZE,
+                 flush_interval=FLUSH_INTERVAL, pool_size=POOL_SIZE, spool_path=SPOOL_PATH):
+        self.pool = ConnectionPool(connect, pool_size)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.spool_path = spool_path
+        placeholder = PLACEHOLDERS[paramstyle]
+        self.sql = "INSERT INTO interactions ({}) VALUES ({})".format(
+            ", ".join(COLUMNS), ", ".join([placeholder] * len(COLUMNS))
+        )
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._stop = threading.Event()
+        self._thread = None
+        self._spool_pending = os.path.exists(spool_path) or os.path.exists(f"{spool_path}.replay")
+        self.enqueued = 0
+        self.dropped = 0
+        self.written = 0
+        self.spooled = 0
+        self.replayed = 0
+        self.quarantined = 0
+        self.failed_flushes = 0
+
+    def start(self):
+        """
+        Start the background writer thread.
+        """
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="interaction-log-writer", daemon=True)
+            self._thread.start()
+
+    def log(self, user_uuid, phone_number, text, response, transfer, end):
+        """
+        Queue one interaction without blocking the caller.
+
+        Returns:
+            bool: False if the queue was full and the row was dropped.
+        """
+        try:
+            self._queue.put_nowait((user_uuid, phone_number, text, response, transfer, end, datetime.now()))
+        except queue.Full:
+            self.dropped += 1
+            return False
+        self.enqueued += 1
+        return True
+
+    def stats(self):
+        """
+        Report queue depth and write, spool and drop counters.
+        """
+        return {
+            "queue_depth": self._queue.qsize(),
+            "queue_size": self._queue.maxsize,
+            "enqueued": self.enqueued,
+            "dropped": self.dropped,
+            "written": self.written,
+            "spooled": self.spooled,
+            "replayed": self.replayed,
+            "quarantined": self.quarantined,
+            "failed_flushes": self.failed_flushes,
+            "spool_pending": self._spool_pending
+        }
+
+    def close(self, timeout=5.0):
+        """
+        Stop the writer after flushing what is already queued.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self.pool.close()
+
+    def _run(self):
+        while not (self._stop.is_set() and self._queue.empty()):
+            batch = []
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            if batch:
+                self._flush(batch)
+            elif self._spool_pending:
+                self._replay_spool()
+
+    def _write(self, rows):
+        conn = self.pool.get()
+        try:
+            cursor = conn.cursor()
+            try:
+                # PyMySQL turns executemany() on an INSERT ... VALUES into multi-row INSERTs
+                cursor.executemany(self.sql, rows)
+            finally:
+                cursor.close()
+            conn.commit()
+        except Exception:
+            self.pool.discard(conn)
+            raise
+        self.pool.put(conn)
+
+    def _flush(self, rows):
+        try:
+            self._write(rows)
+        except Exception as e:
+            self.failed_flushes += 1
+            logger.error(f"Error logging {len(rows)} interactions, spooling to {self.spool_path}: {e}")
+            self._spool(rows)
+            return
+        self.written += len(rows)
+        if self._spool_pending:
+            self._replay_spool()
+
+    def _spool(self, rows):
+        try:
+            with open(self.spool_path, "a") as f:
+                for row in rows:
+                    f.write(json.dumps(list(row[:-1]) + [row[-1].isoformat()]) + "\n")
+        except OSError as e:
+            self.dropped += len(rows)
+            logger.error(f"Error spooling interactions, dropped {len(rows)}: {e}")
+            return
+        self.spooled += len(rows)
+        self._spool_pending = True
+
+    def _replay_spool(self):
+        replay_path = f"{self.spool_path}.replay"
+        try:
+            if not os.path.exists(replay_path):
+                os.replace(self.spool_path, replay_path)
+            with open(replay_path, "r") as f:
+                lines = [line for line in f if line.strip()]
+        except FileNotFoundError:
+            self._spool_pending = False
+            return
+        except OSError as e:
+            logger.error(f"Error reading interaction spool: {e}")
+            return
+        rows, good_lines, bad_lines = [], [], []
+        for line in lines:
+            try:
+                rows.append(self._parse_spooled(line))
+                good_lines.append(line)
+            except (ValueError, TypeError):
+                bad_lines.append(line)
+        if bad_lines and not self._quarantine(bad_lines, good_lines, replay_path):
+            return
+        try:
+            # One transaction, so a failed replay never leaves half the spool written
+            if rows:
+                self._write(rows)
+        except Exception as e:
+            # Keep the replay file; it is retried after the next successful write
+            logger.error(f"Error replaying interaction spool: {e}")
+            return
+        os.remove(replay_path)
+        self.replayed += len(rows)
+        self._spool_pending = os.path.exists(self.spool_path)
+        logger.info(f"Replayed {len(rows)} spooled interactions")
+
+    @staticmethod
+    def _parse_spooled(line):
+        row = json.loads(line)
+        if not isinstance(row, list) or len(row) != len(COLUMNS):
+            raise ValueError(f"expected a list of {len(COLUMNS)} columns")
+        return tuple(row[:-1]) + (datetime.fromisoformat(row[-1]),)
+
+    def _quarantine(self, bad_lines, good_lines, replay_path):
+        # Move bad lines aside and keep only the good ones, so a failed write never re-quarantines them
+        try:
+            with open(f"{self.spool_path}.bad", "a") as f:
+                f.writelines(bad_lines)
+            temp_path = f"{replay_path}.tmp"
+            with open(temp_path, "w") as f:
+                f.writelines(good_lines)
+            os.replace(temp_path, replay_path)
+        except OSError as e:
+            logger.error(f"Error quarantining unreadable spooled interactions: {e}")
+            return False
+        self.quarantined += len(bad_lines)
+        logger.warning(f"Moved {len(bad_lines)} unreadable spooled interactions to {self.spool_path}.bad")
+        return True
+
+_interaction_logger = None
+_interaction_logger_lock = threading.Lock()
+
+def get_interaction_logger(connect, paramstyle="format"):
+    """
+    Return the process-wide interaction logger, creating and starting it on first use.
+
+    It is closed at interpreter exit, so rows queued within the last flush interval are
+    written (or spooled) rather than lost.
+    """
+    global _interaction_logger
+    with _interaction_logger_lock:
+        if _interaction_logger is None:
+            _interaction_logger = InteractionLogger(connect, paramstyle)
+            _interaction_logger.start()
+            atexit.register(_interaction_logger.close)
+        return _interaction_logger
@@ -0,0 +1,336 @@
+"""
+Voicemail and honeypot keyword lists shared by the Flask API (api.py) and the
+Vosk WebSocket server (vosk_server.py).
+
+Kept free of Streamlit and database imports so the recognizer process can
+classify partial transcripts without loading the UI stack.
+
+The lists below are the defaults. If KEYWORDS_FILE exists it replaces them, and
+edits to the file (or PUT /api/keywords in api.py) are compiled in a background
+watcher thread and swapped in atomically.
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+KEYWORDS_FILE = os.environ.get("KEYWORDS_FILE", "keywords.json")
+KEYWORDS_POLL_INTERVAL = float(os.environ.get("KEYWORDS_POLL_INTERVAL", "2"))
+
+# mkstemp creates owner-only files; the saved keyword file gets the mode open() would give it,
+# so a recognizer server running as another user can still read it
+_umask = os.umask(0)
+os.umask(_umask)
+FILE_MODE = 0o666 & ~_umask
+
+# Keyword lists
+voicemail_keywords = [
+    "beep",
+    "tone",
+    "message",
+    "unable",
+    "available",
+    "system",
+    "After the beep",
+    "Please leave a message",
+    "At the tone",
+    "After the tone",
+    "Please leave your message",
+    "Please record a message",
+    "Please record your message",
+    "Voice messaging system",
+    "Unable to answer the phone right now",
+    "Person you are trying to reach is not available"
+]
+honeypot_keywords = [
+    "im listening",
+    "i dont hear you",
+    "please explain",
+    "why are you calling",
+    "say your name",
+    "i did not consent",
+    "otherwise",
+    "date and time",
+    "consent",
+    "please say your name",
+    "please fully describe your product or service",
+    "describe",
+    "product or service",
+    "product",
+    "service",
+    "can you hear me",
+    "what did you say",
+    "location",
+    "company",
+    "located",
+    "email",
+    "are you there",
+    "tell me more",
+    "wait wait wait",
+    "can you hear me good good good",
+    "go ahead and",
+    "go ahead and do it",
+    "blessed day",
+    "call me back later"
+]
+
+def _trie_pattern(phrases):
+    """
+    Build a regular expression matching any of the phrases, factored into a prefix trie.
+
+    Factoring shared prefixes ("please leave ...", "can you hear me ...") lets the regex
+    engine reject a position after one character test per branch instead of retrying every
+    phrase, and optional tails make the longest phrase at a position win.
+    """
+    trie = {}
+    for phrase in phrases:
+        node = trie
+        for char in phrase:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def build(node):
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        pattern = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        return "(?:" + pattern + ")?" if "" in node else pattern
+
+    return build(trie) if phrases else "(?!)"  # An empty list never matches
+
+class KeywordMatcher:
+    """
+    Voicemail and honeypot phrases compiled once into trie-factored regular expressions.
+
+    classify() needs at most one scan per category, voicemail first, which keeps the
+    VM-before-honeypot priority of the original keyword loops. find() reports every
+    phrase occurrence in a single scan with a combined lookahead pattern.
+    """
+
+    def __init__(self, voicemail, honeypot):
+        self.voicemail = tuple(voicemail)
+        self.honeypot = tuple(honeypot)
+        # Content hash, identical across processes and restarts for the same lists
+        self.version = hashlib.sha1(
+            json.dumps([self.voicemail, self.honeypot]).encode("utf-8")
+        ).hexdigest()[:12]
+        # Lowercased phrase -> phrase as written in the list, per category
+        self._phrases = {"voicemail": {}, "honeypot": {}}
+        for category, keywords in (("voicemail", self.voicemail), ("honeypot", self.honeypot)):
+            for keyword in keywords:
+                self._phrases[category].setdefault(keyword.lower(), keyword)
+        self._patterns = {
+            category: re.compile(_trie_pattern(phrases)) for category, phrases in self._phrases.items()
+        }
+        self._all = re.compile("(?=(?P<voicemail>{})|(?P<honeypot>{}))".format(
+            _trie_pattern(self._phrases["voicemail"]),
+            _trie_pattern(self._phrases["honeypot"])
+        ))
+
+    def grammar(self):
+        """
+        Return the phrase list for a Vosk grammar recognizer limited to the keyword vocabulary.
+
+        Phrases are lowercased as the recognizer emits them; "[unk]" absorbs all other speech.
+
+        Returns:
+            list: Voicemail and honeypot phrases, then "[unk]".
+        """
+        phrases = list(self._phrases["voicemail"])
+        phrases += [phrase for phrase in self._phrases["honeypot"] if phrase not in self._phrases["voicemail"]]
+        return phrases + ["[unk]"]
+
+    def _match(self, category, start, phrase):
+        return {
+            "keyword": self._phrases[category][phrase],
+            "category": category,
+            "start": start,
+            "end": start + len(phrase)
+        }
+
+    def classify(self, text):
+        """
+        Classify text by keyword phrases, giving voicemail phrases priority over honeypot phrases.
+
+        Args:
+            text (str): Transcript or utterance to check (matching is case-insensitive).
+
+        Returns:
+            tuple: ("VM", "No VM" or "not available", the first deciding match as a dict with
+            `keyword`, `category`, `start` and `end`, or None).
+        """
+        text_lower = text.lower() if text else ""
+        for category, decision in (("voicemail", "VM"), ("honeypot", "No VM")):
+            match = self._patterns[category].search(text_lower)
+            if match:
+                return decision, self._match(category, match.start(), match.group())
+        return "not available", None
+
+    def find(self, text):
+        """
+        Find every keyword phrase occurrence in text in one pass.
+
+        Where phrases start at the same offset, the voicemail phrase and then the longest
+        phrase is reported.
+
+        Args:
+            text (str): Text to search (matching is case-insensitive).
+
+        Returns:
+            list: One dict per match with `keyword`, `category`, `start` and `end` offsets.
+        """
+        matches = []
+        for match in self._all.finditer(text.lower() if text else ""):
+            category = match.lastgroup
+            matches.append(self._match(category, match.start(), match.group(category)))
+        return matches
+
+_matcher = KeywordMatcher(voicemail_keywords, honeypot_keywords)
+_update_lock = threading.Lock()
+_watcher = None
+
+def get_matcher():
+    """
+    Return the matcher compiled for the current keyword lists.
+
+    Swaps replace the module-level reference in one assignment, so callers always
+    see either the old or the new matcher, never a partially built one.
+    """
+    return _matcher
+
+def validate_keywords(data):
+    """
+    Check a keyword set before it is compiled.
+
+    Args:
+        data (dict): Mapping with `voicemail` and `honeypot` lists of phrases.
+
+    Returns:
+        tuple: (voicemail phrases, honeypot phrases).
+
+    Raises:
+        ValueError: If the keyword set is malformed.
+    """
+    if not isinstance(data, dict):
+        raise ValueError("Keyword set must be an object with voicemail and honeypot lists")
+    lists = []
+    for category in ("voicemail", "honeypot"):
+        phrases = data.get(category)
+        if not isinstance(phrases, list):
+            raise ValueError(f"Missing or invalid {category} keyword list")
+        for phrase in phrases:
+            if not isinstance(phrase, str) or not phrase.strip():
+                raise ValueError(f"Invalid {category} keyword: {phrase!r}")
+        lists.append([phrase.strip() for phrase in phrases])
+    return lists[0], lists[1]
+
+def set_keywords(voicemail, honeypot):
+    """
+    Replace the keyword lists and compile a new matcher for them.
+
+    The old matcher stays in place until compilation succeeds.
+
+    Args:
+        voicemail (list): Voicemail phrases.
+        honeypot (list): Honeypot phrases.
+
+    Returns:
+        KeywordMatcher: The matcher now in use.
+
+    Raises:
+        ValueError: If the keyword set is malformed or does not compile.
+    """
+    global voicemail_keywords, honeypot_keywords, _matcher
+    voicemail, honeypot = validate_keywords({"voicemail": voicemail, "honeypot": honeypot})
+    try:
+        matcher = KeywordMatcher(voicemail, honeypot)
+    except re.error as e:
+        raise ValueError(f"Keyword set does not compile: {e}")
+    with _update_lock:
+        if matcher.version != _matcher.version:
+            voicemail_keywords, honeypot_keywords = list(matcher.voicemail), list(matcher.honeypot)
+            _matcher = matcher
+            logger.info(f"Keyword matcher {matcher.version} active "
+                        f"({len(matcher.voicemail)} voicemail, {len(matcher.honeypot)} honeypot phrases)")
+        return _matcher
+
+def save_keywords(voicemail, honeypot, path=KEYWORDS_FILE):
+    """
+    Compile and activate a keyword set, then persist it to the keywords file so other
+    processes watching the file pick it up too.
+
+    Returns:
+        KeywordMatcher: The matcher now in use.
+
+    Raises:
+        ValueError: If the keyword set is malformed or does not compile.
+    """
+    matcher = set_keywords(voicemail, honeypot)
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump({"voicemail": list(matcher.voicemail), "honeypot": list(matcher.honeypot)}, f, indent=4)
+        os.chmod(temp_path, FILE_MODE)
+        os.replace(temp_path, path)
+    except OSError:
+        os.unlink(temp_path)
+        raise
+    return matcher
+
+def reload_keywords(path=KEYWORDS_FILE):
+    """
+    Load the keyword set from a JSON file, keeping the current matcher if the file is invalid.
+
+    Returns:
+        bool: True if the file was loaded.
+    """
+    try:
+        with open(path, "r") as f:
+            data = json.load(f)
+        voicemail, honeypot = validate_keywords(data)
+        set_keywords(voicemail, honeypot)
+        return True
+    except FileNotFoundError:
+        return False
+    except (OSError, ValueError) as e:
+        logger.error(f"Ignoring invalid keyword file {path}, keeping matcher {_matcher.version}: {e}")
+        return False
+
+def _keywords_mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+def _watch_keywords(path, interval, last_mtime):
+    while True:
+        time.sleep(interval)
+        mtime = _keywords_mtime(path)
+        if mtime is not None and mtime != last_mtime:
+            reload_keywords(path)
+        last_mtime = mtime
+
+def start_watcher(path=KEYWORDS_FILE, interval=KEYWORDS_POLL_INTERVAL):
+    """
+    Start the background thread that recompiles the keyword file when it changes.
+
+    Safe to call more than once; only one watcher runs per process.
+    """
+    global _watcher
+    if _watcher is not None:
+        return
+    # Load the file once up front so requests never see the defaults when a file exists
+    last_mtime = _keywords_mtime(path)
+    reload_keywords(path)
+    with _update_lock:
+        if _watcher is not None:
+            return
+        _watcher = threading.Thread(target=_watch_keywords, args=(path, interval, last_mtime),
+                                    name="keyword-watcher", daemon=True)
+        _watcher.start()
@@ -0,0 +1,229 @@
+"""
+Content-addressed cache of /transcribe results for client.py.
+
+Results are keyed by the SHA-256 of the audio plus the recognizer config, so the
+same greeting fetched from any URL is decoded once. Results whose decision or
+transcript depends on the keyword set (early_decision and keyword-mode sessions)
+are also keyed on the keyword version, so a keyword edit is never answered from
+results classified with the old set. A memory tier holds results in
+LRU order up to TRANSCRIPTION_CACHE_MAX_BYTES; if TRANSCRIPTION_CACHE_DIR is set,
+results are also written there as JSON files and survive restarts.
+
+For each URL the cache also remembers the ETag, Last-Modified and content hash of
+the last download, so the client can revalidate with a conditional GET and skip
+the download entirely on 304 Not Modified.
+
+Used from the client's event loop only, so no locking is needed.
+"""
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+TRANSCRIPTION_CACHE_ENABLED = os.environ.get("TRANSCRIPTION_CACHE_ENABLED", "1") == "1"
+TRANSCRIPTION_CACHE_MAX_BYTES = int(os.environ.get("TRANSCRIPTION_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+TRANSCRIPTION_CACHE_MAX_URLS = int(os.environ.get("TRANSCRIPTION_CACHE_MAX_URLS", "10000"))
+TRANSCRIPTION_CACHE_DIR = os.environ.get("TRANSCRIPTION_CACHE_DIR", "")  # Empty disables the disk tier
+# Downloads up to this size are hashed before decoding, so a cached result skips the recognizer;
+# larger or unsized downloads are streamed to the recognizer and hashed on the way
+TRANSCRIPTION_CACHE_PREFETCH_BYTES = int(os.environ.get("TRANSCRIPTION_CACHE_PREFETCH_BYTES", str(2 * 1024 * 1024)))
+
+def config_fingerprint(config):
+    """
+    Return a stable digest of a recognizer config; key order does not matter.
+    """
+    canonical = json.dumps(config or {}, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha1(canonical.encode("utf-8")).hexdigest()[:12]
+
+def depends_on_keywords(config):
+    """
+    Return True if results for this recognizer config change with the keyword set.
+    """
+    return isinstance(config, dict) and bool(config.get("early_decision") or config.get("mode") == "keywords")
+
+class TranscriptionCache:
+    """
+    Two-tier (memory, disk) cache of transcription results plus per-URL validators.
+    """
+
+    def __init__(self, max_bytes=TRANSCRIPTION_CACHE_MAX_BYTES, directory=TRANSCRIPTION_CACHE_DIR,
+                 max_urls=TRANSCRIPTION_CACHE_MAX_URLS):
+        self.max_bytes = max_bytes
+        self.directory = directory or None
+        self.max_urls = max_urls
+        self._entries = OrderedDict()  # Key -> (result, size in bytes), least recently used first
+        self._urls = OrderedDict()  # URL -> {"etag", "last_modified", "content_hash"}
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+
+    @staticmethod
+    def key(content_hash, config, keywords_version=None):
+        """
+        Build the cache key for a piece of audio decoded with a given config and, for
+        keyword-dependent configs, keyword set.
+        """
+        key = f"{content_hash}-{config_fingerprint(config)}"
+        return f"{key}-{keywords_version}" if keywords_version else key
+
+    def get(self, key):
+        """
+        Look up a result, promoting disk hits into memory.
+
+        Returns:
+            tuple: (copy of the cached result, "memory" | "disk"), or (None, None) on a miss.
+        """
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return dict(entry[0]), "memory"
+        result = self._read_disk(key)
+        if result is not None:
+            self._store(key, dict(result))
+            self.hits += 1
+            return result, "disk"
+        self.misses += 1
+        return None, None
+
+    def peek(self, key):
+        """
+        Look up a result without touching the counters or the LRU order.
+
+        Returns:
+            tuple: (copy of the cached result, "memory" | "disk"), or (None, None) if absent.
+        """
+        entry = self._entries.get(key)
+        if entry is not None:
+            return dict(entry[0]), "memory"
+        result = self._read_disk(key)
+        return (dict(result), "disk") if result is not None else (None, None)
+
+    def record_hit(self, key, result):
+        """
+        Count a hit for a result obtained with peek(), e.g. after the URL revalidated.
+        """
+        if key in self._entries:
+            self._entries.move_to_end(key)
+        else:
+            self._store(key, dict(result))
+        self.hits += 1
+
+    def record_miss(self):
+        """
+        Count a transcription that had to be decoded without a lookup, e.g. a streamed download.
+        """
+        self.misses += 1
+
+    def put(self, key, result):
+        """
+        Cache a result in memory and, if enabled, on disk.
+        """
+        # Drop the fields that describe one request rather than the audio
+        result = {k: v for k, v in result.items() if k not in ("cache", "processing_time", "backend", "attempts")}
+        self._store(key, result)
+        if self.directory:
+            self._write_disk(key, result)
+
+    def url_validators(self, url):
+        """
+        Return the ETag, Last-Modified and content hash recorded for a URL, or None.
+        """
+        validators = self._urls.get(url)
+        if validators is not None:
+            self._urls.move_to_end(url)
+        return validators
+
+    def remember_url(self, url, etag, last_modified, content_hash):
+        """
+        Record what a URL served so the next request can revalidate it.
+        """
+        if not (etag or last_modified):
+            self._urls.pop(url, None)
+            return
+        self._urls[url] = {"etag": etag, "last_modified": last_modified, "content_hash": content_hash}
+        self._urls.move_to_end(url)
+        while len(self._urls) > self.max_urls:
+            self._urls.popitem(last=False)
+
+    def metadata(self, status, tier=None):
+        """
+        Build the `cache` block added to a /transcribe response.
+        """
+        return {"status": status, "tier": tier, "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+    def stats(self):
+        """
+        Report entry counts, memory use and hit, miss and eviction counters.
+        """
+        return {
+            "entries": len(self._entries),
+            "bytes": self.size,
+            "max_bytes": self.max_bytes,
+            "urls": len(self._urls),
+            "disk": self.directory is not None,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions
+        }
+
+    def _store(self, key, result):
+        size = len(json.dumps(result))
+        if size > self.max_bytes:
+            return
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self.size -= old[1]
+        self._entries[key] = (result, size)
+        self.size += size
+        while self.size > self.max_bytes:
+            _, (_, evicted_size) = self._entries.popitem(last=False)
+            self.size -= evicted_size
+            self.evictions += 1
+
+    def _disk_path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def _read_disk(self, key):
+        if not self.directory:
+            return None
+        try:
+            with open(self._disk_path(key), "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.error(f"Error reading cached transcription {key}: {e}")
+            return None
+
+    def _write_disk(self, key, result):
+        try:
+            fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        except OSError as e:
+            logger.error(f"Error writing cached transcription {key}: {e}")
+            return
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(result, f)
+            os.replace(temp_path, self._disk_path(key))
+        except OSError as e:
+            os.unlink(temp_path)
+            logger.error(f"Error writing cached transcription {key}: {e}")
+
+_transcription_cache = None
+
+def get_transcription_cache():
+    """
+    Return the process-wide transcription cache, or None if it is disabled.
+    """
+    global _transcription_cache
+    if TRANSCRIPTION_CACHE_ENABLED and _transcription_cache is None:
+        _transcription_cache = TranscriptionCache()
+    return _transcription_cache
@@ -1,150 +1,1431 @@
-import asyncio
-import os
-import websockets
-import json
-from vosk import Model, KaldiRecognizer
-from pydub import AudioSegment
-import io
-import time
-import logging
-
-# Configure logging for debugging
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
-logger = logging.getLogger(__name__)
-
-def convert_to_wav(audio_data, filename):
-    """
-    Convert audio data to WAV format (16kHz, mono, 16-bit PCM) for Vosk.
-
-    Args:
-        audio_data (bytes): Raw audio data.
-        filename (str): Name of the audio file to determine format.
-
-    Returns:
-        tuple: (converted WAV data as bytes, error message if any).
-    """
-    try:
-        file_extension = os.path.splitext(filename)[1].lower()
-        if file_extension not in ['.mp3', '.wav']:
-            return None, f"Unsupported file format: {file_extension}"
-
-        audio = AudioSegment.from_file(io.BytesIO(audio_data), format=file_extension[1:])
-        audio = audio.set_channels(1).set_frame_rate(16000).set_sample_width(2)
-        output = io.BytesIO()
-        audio.export(output, format="wav")
-        return output.getvalue(), None
-    except Exception as e:
-        logger.error(f"Error converting audio: {str(e)}")
-        return None, f"Error converting audio: {str(e)}"
-
-async def recognize(websocket, path=None):
-    """
-    Handle WebSocket connections, process JSON configs and audio data, and send transcription results.
-
-    Args:
-        websocket: WebSocket connection object.
-        path: WebSocket path (unused).
-    """
-    try:
-        model_path = "/home/ubuntu/vosk_model"
-        if not os.path.exists(model_path):
-            error_msg = f"Vosk model not found at {model_path}"
-            logger.error(error_msg)
-            await websocket.send(json.dumps({"error": error_msg}))
-            return
-
-        logger.info("Loading Vosk model...")
-        start_time = time.time()
-        model = Model(model_path)
-        rec = KaldiRecognizer(model, 16000)
-        logger.info(f"Model loaded in {time.time() - start_time:.2f} seconds")
-
-        filename = "input.wav"
-        while True:
-            try:
-                message = await asyncio.wait_for(websocket.recv(), timeout=120.0)
-                logger.debug(f"Received message type: {type(message)}")
-
-                if isinstance(message, str):
-                    try:
-                        config = json.loads(message)
-                        logger.debug(f"Received JSON: {config}")
-
-                        if "filename" in config:
-                            filename = config["filename"]
-                            await websocket.send(json.dumps({"status": f"Received filename: {filename}"}))
-                        if "config" in config:
-                            rec.SetMaxAlternatives(0)
-                            rec.SetWords(True)
-                            await websocket.send(json.dumps({"status": "Configuration applied"}))
-                        if "eof" in config:
-                            start_time = time.time()
-                            result = json.loads(rec.Result())
-                            result["status"] = "Final transcription"
-                            await websocket.send(json.dumps(result))
-                            logger.info(f"Sent final result: {result}, took {time.time() - start_time:.2f} seconds")
-                            await asyncio.sleep(1)  # Ensure client receives final message
-                            break
-                    except json.JSONDecodeError as e:
-                        error_msg = f"Invalid JSON: {str(e)}"
-                        logger.error(error_msg)
-                        await websocket.send(json.dumps({"error": error_msg}))
-                elif isinstance(message, bytes):
-                    logger.debug(f"Processing audio data, size: {len(message)} bytes")
-                    await websocket.send(json.dumps({"status": "Processing audio..."}))
-
-                    start_time = time.time()
-                    wav_data, error = convert_to_wav(message, filename)
-                    if error:
-                        await websocket.send(json.dumps({"error": error}))
-                        continue
-
-                    logger.debug(f"Audio conversion took {time.time() - start_time:.2f} seconds")
-
-                    if rec.AcceptWaveform(wav_data):
-                        result = json.loads(rec.Result())
-                        await websocket.send(json.dumps(result))
-                        logger.info(f"Sent final result: {result}")
-                    else:
-                        partial = json.loads(rec.PartialResult())
-                        await websocket.send(json.dumps(partial))
-                        logger.debug(f"Sent partial result: {partial}")
-                else:
-                    error_msg = "Unsupported message type"
-                    logger.error(error_msg)
-                    await websocket.send(json.dumps({"error": error_msg}))
-
-            except asyncio.TimeoutError:
-                logger.warning("Receive timeout, sending keepalive")
-                await websocket.send(json.dumps({"status": "Keepalive"}))
-                continue
-
-    except websockets.exceptions.ConnectionClosedError as e:
-        logger.warning(f"WebSocket connection closed: {e}")
-    except Exception as e:
-        logger.error(f"Error in WebSocket handler: {e}")
-        try:
-            await websocket.send(json.dumps({"error": str(e)}))
-        except websockets.exceptions.ConnectionClosedError:
-            logger.warning("Failed to send error message: connection already closed")
-
-async def main():
-    """
-    Start the WebSocket server with increased ping timeout for stability.
-    """
-    try:
-        server = await websockets.serve(
-            recognize,
-            "localhost",
-            2700,
-            ping_interval=30,
-            ping_timeout=120,
-            close_timeout=10
-        )
-        logger.info("Vosk WebSocket server running on ws://localhost:2700")
-        await server.wait_closed()
-    except Exception as e:
-        logger.error(f"Error starting server: {e}")
-
-if __name__ == "__main__":
-    asyncio.run(main())
+import asyncio
+import gc
+import os
+import signal
+import socket
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import websockets
+import json
+import numpy as np
+from vosk import Model, KaldiRecognizer
+from keywords import get_matcher, start_watcher
+import time
+import logging
+
+# Configure logging for debugging (LOG_LEVEL=INFO quiets the per-frame messages)
+logging.basicConfig(level=os.environ.get("LOG_LEVEL", "DEBUG"), format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Recognizer settings (overridable through the environment)
+MODEL_PATH = os.environ.get("VOSK_MODEL_PATH", "/home/ubuntu/vosk_model")
+SAMPLE_RATE = 16000
+RECOGNIZER_POOL_SIZE = int(os.environ.get("VOSK_POOL_SIZE", "4"))
+RECOGNIZER_WAIT_TIMEOUT = float(os.environ.get("VOSK_POOL_TIMEOUT", "30"))
+SERVER_WORKERS = int(os.environ.get("VOSK_WORKERS", "1"))  # Above 1, a supervisor pre-forks this many processes
+DECODE_WORKERS = int(os.environ.get("VOSK_DECODE_WORKERS", str(max(1, (os.cpu_count() or 1) // SERVER_WORKERS))))
+DRAIN_TIMEOUT = float(os.environ.get("VOSK_DRAIN_TIMEOUT", "30"))  # Seconds running sessions get to finish on shutdown
+FFMPEG_PATH = os.environ.get("FFMPEG_PATH", "ffmpeg")
+SERVER_HOST = os.environ.get("VOSK_SERVER_HOST", "localhost")
+SERVER_PORT = int(os.environ.get("VOSK_SERVER_PORT", "2700"))  # Run one server per port to test several backends locally
+PCM_FRAME_BYTES = 6400  # 0.2 seconds of 16 kHz 16-bit mono audio per recognizer call
+MUX_SESSION_INBOX = 8  # Messages buffered per session on a multiplexed connection
+FFMPEG_STDERR_BYTES = 4096  # Tail of ffmpeg's stderr kept for error messages
+
+# Benchmarking: VOSK_STUB=1 replaces the model with StubRecognizer, so no model is needed or loaded
+RECOGNIZER_STUB = os.environ.get("VOSK_STUB", "0") == "1"
+STUB_TRANSCRIPT = os.environ.get("VOSK_STUB_TEXT", "please leave a message after the tone")
+STUB_UTTERANCE_BYTES = SAMPLE_RATE * 2 * 2  # The stub ends an utterance every 2 seconds of audio
+
+# Voice activity detection; sessions can override VOSK_VAD with {"config": {"vad": true | false}}
+VAD_ENABLED = os.environ.get("VOSK_VAD", "0") == "1"
+VAD_FRAME_SAMPLES = 320  # 20 ms at 16 kHz
+VAD_THRESHOLD_DB = float(os.environ.get("VOSK_VAD_THRESHOLD_DB", "-45"))  # Quieter frames (dBFS) are silence
+VAD_MAX_ZCR = float(os.environ.get("VOSK_VAD_MAX_ZCR", "0.5"))  # Zero-crossing rate above which a frame is noise
+VAD_HANGOVER_MS = int(os.environ.get("VOSK_VAD_HANGOVER_MS", "600"))  # Silence kept after speech
+VAD_PREROLL_MS = int(os.environ.get("VOSK_VAD_PREROLL_MS", "100"))  # Audio kept before speech onsets
+
+# Keyword-spotting mode; sessions opt in with {"config": {"mode": "keywords"}}
+GRAMMAR_MODEL_PATH = os.environ.get("VOSK_GRAMMAR_MODEL_PATH", "")  # Empty reuses VOSK_MODEL_PATH
+GRAMMAR_POOL_SIZE = int(os.environ.get("VOSK_GRAMMAR_POOL_SIZE", str(RECOGNIZER_POOL_SIZE)))
+GRAMMAR_CACHE_VERSIONS = 2  # Keyword-set versions whose grammar pools are kept
+
+# Beep detection; sessions can override VOSK_BEEP with {"config": {"beep": ..., "stop_on_beep": ...}}
+BEEP_ENABLED = os.environ.get("VOSK_BEEP", "0") == "1"
+BEEP_WINDOW = 512  # 32 ms FFT window at 16 kHz, about 31 Hz per bin
+BEEP_MIN_HZ = float(os.environ.get("VOSK_BEEP_MIN_HZ", "400"))
+BEEP_MAX_HZ = float(os.environ.get("VOSK_BEEP_MAX_HZ", "2500"))
+BEEP_MIN_MS = int(os.environ.get("VOSK_BEEP_MIN_MS", "150"))  # Shortest tone reported as a beep
+BEEP_PURITY = float(os.environ.get("VOSK_BEEP_PURITY", "0.85"))  # Share of frame energy in the peak
+BEEP_THRESHOLD_DB = float(os.environ.get("VOSK_BEEP_THRESHOLD_DB", "-40"))  # Quieter frames (dBFS) are ignored
+
+# Process-wide models, recognizer pools and decode executor, created once in main()
+model = None
+grammar_model = None
+recognizer_pool = None
+grammar_pools = None
+decode_executor = None
+draining = False  # Set by drain(); multiplexed connections then refuse new sessions
+
+class StubRecognizer:
+    """
+    Model-free stand-in for KaldiRecognizer, used with VOSK_STUB=1.
+
+    Counts audio instead of decoding it: every STUB_UTTERANCE_BYTES ends an utterance whose
+    text is STUB_TRANSCRIPT, and partial results reveal it word by word in between. Everything
+    around the recognizer (transport, ffmpeg and in-process conversion, VAD, pooling) runs as
+    usual, so benchmarks measure that overhead on its own.
+    """
+
+    def __init__(self, model=None, sample_rate=SAMPLE_RATE, grammar=None):
+        self.words = STUB_TRANSCRIPT.split()
+        self.audio_bytes = 0
+
+    def AcceptWaveform(self, data):
+        self.audio_bytes += len(data)
+        return self.audio_bytes >= STUB_UTTERANCE_BYTES
+
+    def Result(self):
+        text = STUB_TRANSCRIPT if self.audio_bytes else ""
+        self.audio_bytes = 0
+        return json.dumps({"text": text})
+
+    def FinalResult(self):
+        return self.Result()
+
+    def PartialResult(self):
+        heard = len(self.words) * self.audio_bytes // STUB_UTTERANCE_BYTES
+        return json.dumps({"partial": " ".join(self.words[:heard])})
+
+    def Reset(self):
+        self.audio_bytes = 0
+
+    def SetMaxAlternatives(self, alternatives):
+        pass
+
+    def SetWords(self, enabled):
+        pass
+
+def create_recognizer(model, sample_rate=SAMPLE_RATE, grammar=None):
+    """
+    Create a recognizer for a model, restricted to a grammar (JSON list of phrases) if given.
+    """
+    if RECOGNIZER_STUB:
+        return StubRecognizer(model, sample_rate, grammar)
+    if grammar is not None:
+        return KaldiRecognizer(model, sample_rate, grammar)
+    return KaldiRecognizer(model, sample_rate)
+
+def load_model(model_path=MODEL_PATH):
+    """
+    Load the Vosk model and run a short warm-up decode so the first call does not pay for it.
+
+    Args:
+        model_path (str): Path to the Vosk model directory.
+
+    Returns:
+        Model: The loaded Vosk model.
+    """
+    logger.info(f"Loading Vosk model from {model_path}...")
+    start_time = time.time()
+    loaded_model = Model(model_path)
+    logger.info(f"Model loaded in {time.time() - start_time:.2f} seconds")
+
+    start_time = time.time()
+    warmup = KaldiRecognizer(loaded_model, SAMPLE_RATE)
+    warmup.AcceptWaveform(b"\x00\x00" * SAMPLE_RATE)  # One second of silence
+    warmup.FinalResult()
+    logger.info(f"Warm-up decode took {time.time() - start_time:.2f} seconds")
+    return loaded_model
+
+class RecognizerPool:
+    """
+    Bounded pool of reusable KaldiRecognizer instances sharing one model.
+
+    Sessions check a recognizer out with acquire() and hand it back with release(),
+    which resets it so the next session starts from a clean decoder state. With a
+    `grammar` (JSON list of phrases) every recognizer is restricted to those phrases.
+    """
+
+    def __init__(self, model, size=RECOGNIZER_POOL_SIZE, sample_rate=SAMPLE_RATE, grammar=None):
+        self.model = model
+        self.size = size
+        self.sample_rate = sample_rate
+        self.grammar = grammar
+        self._idle = asyncio.Queue()
+        for _ in range(size):
+            self._idle.put_nowait(self._create())
+        self.checkouts = 0
+        self.timeouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.last_wait = 0.0
+
+    def _create(self):
+        return create_recognizer(self.model, self.sample_rate, self.grammar)
+
+    @property
+    def in_use(self):
+        return self.size - self._idle.qsize()
+
+    async def acquire(self, timeout=RECOGNIZER_WAIT_TIMEOUT):
+        """
+        Check out a recognizer, waiting up to `timeout` seconds for one to become free.
+
+        Raises:
+            asyncio.TimeoutError: If no recognizer was returned in time.
+        """
+        start_time = time.monotonic()
+        try:
+            rec = await asyncio.wait_for(self._idle.get(), timeout=timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            logger.warning(f"Recognizer pool exhausted after {timeout:.1f} seconds ({self.in_use}/{self.size} in use)")
+            raise
+        wait = time.monotonic() - start_time
+        self.checkouts += 1
+        self.total_wait += wait
+        self.last_wait = wait
+        self.max_wait = max(self.max_wait, wait)
+        logger.debug(f"Recognizer checked out after {wait * 1000:.1f} ms ({self.in_use}/{self.size} in use)")
+        return rec
+
+    def release(self, rec):
+        """
+        Reset a recognizer and return it to the pool.
+        """
+        try:
+            rec.Reset()
+            rec.SetMaxAlternatives(0)
+            rec.SetWords(False)
+        except Exception as e:
+            # A recognizer in a bad state is replaced rather than handed out again
+            logger.error(f"Error resetting recognizer, replacing it: {e}")
+            rec = self._create()
+        self._idle.put_nowait(rec)
+
+    def stats(self):
+        """
+        Report pool occupancy and checkout wait times.
+        """
+        return {
+            "size": self.size,
+            "in_use": self.in_use,
+            "checkouts": self.checkouts,
+            "timeouts": self.timeouts,
+            "last_wait_ms": round(self.last_wait * 1000, 2),
+            "avg_wait_ms": round(self.total_wait / self.checkouts * 1000, 2) if self.checkouts else 0.0,
+            "max_wait_ms": round(self.max_wait * 1000, 2),
+        }
+
+class GrammarPools:
+    """
+    Recognizer pools restricted to the voicemail and honeypot phrases, one per keyword-set version.
+
+    A grammar recognizer only searches the keyword phrases plus "[unk]", so it decodes far
+    faster than the full-vocabulary model, and sessions that only need a VM / No VM decision
+    can use one. The pool for a version is built in the decode executor the first time a
+    session asks for it. The GRAMMAR_CACHE_VERSIONS most recent versions are kept, so sessions
+    started before a keyword edit finish on their own pool while new sessions use the new one.
+    """
+
+    def __init__(self, model, size=GRAMMAR_POOL_SIZE, versions=GRAMMAR_CACHE_VERSIONS):
+        self.model = model
+        self.size = size
+        self.versions = versions
+        self._pools = OrderedDict()  # Keyword version -> task building its RecognizerPool, oldest first
+        self.builds = 0
+
+    async def get(self):
+        """
+        Return the grammar pool for the current keyword set, building it if needed.
+
+        Returns:
+            tuple: (keyword version, RecognizerPool).
+        """
+        matcher = get_matcher()
+        build = self._pools.get(matcher.version)
+        if build is None:
+            build = asyncio.ensure_future(self._build(matcher))
+            self._pools[matcher.version] = build
+            while len(self._pools) > self.versions:
+                # Sessions still holding recognizers from an evicted pool release them into it as usual
+                self._pools.popitem(last=False)
+        else:
+            self._pools.move_to_end(matcher.version)
+        try:
+            return matcher.version, await asyncio.shield(build)
+        except Exception:
+            if self._pools.get(matcher.version) is build:
+                del self._pools[matcher.version]  # Retry the build on the next request
+            raise
+
+    async def _build(self, matcher):
+        grammar = json.dumps(matcher.grammar())
+        start_time = time.time()
+        loop = asyncio.get_running_loop()
+        # Compiling a grammar takes a while, so the recognizers are created off the event loop
+        pool = await loop.run_in_executor(decode_executor, RecognizerPool, self.model, self.size, SAMPLE_RATE, grammar)
+        self.builds += 1
+        logger.info(f"Grammar pool for keywords {matcher.version} ready with {self.size} recognizers "
+                    f"in {time.time() - start_time:.2f} seconds")
+        return pool
+
+    @property
+    def in_use(self):
+        return sum(build.result().in_use for build in self._pools.values() if build.done() and not build.exception())
+
+    def stats(self):
+        """
+        Report the cached keyword versions and their pool occupancy.
+        """
+        return {
+            "versions": [version for version, build in self._pools.items() if build.done() and not build.exception()],
+            "in_use": self.in_use,
+            "builds": self.builds
+        }
+
+# Raw encodings accepted on the in-process fast path, declared as "<encoding>@<sample rate>"
+RAW_ENCODINGS = ("pcm_s16le", "mulaw", "alaw")
+LOWPASS_TAPS = 63  # Anti-aliasing FIR length for input above 16 kHz
+
+def _build_g711_tables():
+    """
+    Build 256-entry lookup tables mapping G.711 mu-law and A-law codes to 16-bit PCM.
+    """
+    codes = np.arange(256, dtype=np.int32)
+
+    u = ~codes & 0xFF
+    exponent = (u >> 4) & 0x07
+    magnitude = ((((u & 0x0F) << 3) + 0x84) << exponent) - 0x84
+    mulaw = np.where(u & 0x80, -magnitude, magnitude).astype(np.int16)
+
+    a = codes ^ 0x55
+    exponent = (a >> 4) & 0x07
+    mantissa = (a & 0x0F) << 4
+    magnitude = np.where(exponent == 0, mantissa + 8, (mantissa + 0x108) << np.maximum(exponent - 1, 0))
+    alaw = np.where(a & 0x80, magnitude, -magnitude).astype(np.int16)
+    return mulaw, alaw
+
+MULAW_TABLE, ALAW_TABLE = _build_g711_tables()
+
+def parse_encoding(spec, sample_rate=None):
+    """
+    Parse an input encoding declaration such as "mulaw@8000" or "pcm_s16le@16000".
+
+    Args:
+        spec (str): Encoding name, optionally followed by "@<sample rate>".
+        sample_rate (int): Sample rate to use when the spec does not include one.
+
+    Returns:
+        tuple: (encoding, sample rate, error message if any).
+    """
+    encoding, _, rate = str(spec).strip().lower().partition("@")
+    if encoding not in RAW_ENCODINGS:
+        return None, None, f"Unsupported encoding: {encoding}"
+    try:
+        rate = int(rate or sample_rate or SAMPLE_RATE)
+    except (TypeError, ValueError):
+        return None, None, f"Invalid sample rate: {rate or sample_rate}"
+    if not 4000 <= rate <= 48000:
+        return None, None, f"Unsupported sample rate: {rate}"
+    return encoding, rate, None
+
+class LinearResampler:
+    """
+    Streaming linear-interpolation resampler that carries its phase across blocks.
+    """
+
+    def __init__(self, source_rate, target_rate=SAMPLE_RATE):
+        self.step = source_rate / target_rate
+        self.position = 0.0  # Next output position, relative to the first sample of the current block
+        self.previous = None  # Last input sample of the previous block
+
+    def process(self, samples):
+        """
+        Resample a block of int16 samples.
+
+        Args:
+            samples (numpy.ndarray): Input samples.
+
+        Returns:
+            numpy.ndarray: Resampled int16 samples.
+        """
+        if self.previous is not None:
+            samples = np.concatenate((self.previous, samples))
+        if len(samples) == 0:
+            return samples.astype(np.int16)
+        last = len(samples) - 1
+        count = int((last - self.position) // self.step) + 1 if last >= self.position else 0
+        positions = self.position + self.step * np.arange(count)
+        output = np.interp(positions, np.arange(len(samples)), samples.astype(np.float32))
+        # The last input sample becomes index 0 of the next block
+        self.position = self.position + self.step * count - last
+        self.previous = samples[-1:]
+        return np.clip(np.rint(output), -32768, 32767).astype(np.int16)
+
+class LowPassFilter:
+    """
+    Streaming windowed-sinc FIR low-pass that carries its history across blocks.
+
+    Applied before downsampling, so content above the target Nyquist frequency is removed
+    instead of aliasing into the band the recognizer hears.
+    """
+
+    def __init__(self, source_rate, target_rate=SAMPLE_RATE, taps=LOWPASS_TAPS):
+        cutoff = 0.45 * target_rate / source_rate  # Cycles per input sample, just below the target Nyquist
+        n = np.arange(taps) - (taps - 1) / 2
+        kernel = np.sinc(2 * cutoff * n) * np.hamming(taps)
+        self.kernel = (kernel / kernel.sum()).astype(np.float32)
+        self.history = np.zeros(taps - 1, dtype=np.float32)
+
+    def process(self, samples):
+        """
+        Filter a block of samples; the output is delayed by (taps - 1) / 2 samples.
+
+        Returns:
+            numpy.ndarray: Filtered float32 samples, one per input sample.
+        """
+        padded = np.concatenate((self.history, samples.astype(np.float32)))
+        self.history = padded[len(padded) - len(self.history):]
+        return np.convolve(padded, self.kernel, mode="valid")
+
+class PcmDecoder:
+    """
+    In-process decoder for raw PCM and G.711 telephony audio.
+
+    Frames are decoded and resampled to 16 kHz mono with vectorized NumPy code;
+    16 kHz 16-bit PCM that arrives sample-aligned is passed through untouched.
+    Input above 16 kHz is low-pass filtered before it is downsampled.
+    """
+
+    def __init__(self, encoding, sample_rate):
+        self.encoding = encoding
+        self.sample_rate = sample_rate
+        self.resampler = LinearResampler(sample_rate) if sample_rate != SAMPLE_RATE else None
+        self.lowpass = LowPassFilter(sample_rate) if sample_rate > SAMPLE_RATE else None
+        self._remainder = b""
+
+    def decode(self, data):
+        """
+        Decode one frame of input audio.
+
+        Args:
+            data (bytes): Raw audio frame in the declared encoding.
+
+        Returns:
+            bytes: 16 kHz mono 16-bit little-endian PCM.
+        """
+        if self.encoding == "pcm_s16le":
+            if self._remainder:
+                data = self._remainder + data
+            usable = len(data) - len(data) % 2
+            self._remainder = data[usable:]
+            if self.resampler is None:
+                return data if usable == len(data) else data[:usable]
+            samples = np.frombuffer(data, dtype="<i2", count=usable // 2)
+        elif self.encoding == "mulaw":
+            samples = MULAW_TABLE[np.frombuffer(data, dtype=np.uint8)]
+        else:
+            samples = ALAW_TABLE[np.frombuffer(data, dtype=np.uint8)]
+
+        if self.lowpass is not None:
+            samples = self.lowpass.process(samples)
+        if self.resampler is not None:
+            samples = self.resampler.process(samples)
+        return samples.astype("<i2", copy=False).tobytes()
+
+class VoiceActivityDetector:
+    """
+    Energy and zero-crossing voice activity detector for 16 kHz PCM.
+
+    Audio is cut into 20 ms frames and each block is classified in one vectorized pass.
+    A frame is speech if it is louder than VAD_THRESHOLD_DB and crosses zero less often
+    than VAD_MAX_ZCR (broadband hiss crosses far more often than voice). Frames up to
+    VAD_HANGOVER_MS after speech are kept, so the recognizer still sees the trailing
+    silence its endpointing needs, and VAD_PREROLL_MS before an onset, so word starts
+    are not clipped. Everything else is dropped before it reaches the recognizer.
+    """
+
+    def __init__(self, threshold_db=VAD_THRESHOLD_DB, max_zcr=VAD_MAX_ZCR,
+                 hangover_ms=VAD_HANGOVER_MS, preroll_ms=VAD_PREROLL_MS):
+        self.threshold = (32768.0 ** 2) * 10 ** (threshold_db / 10)  # Mean-square power of a threshold_db frame
+        self.max_zcr = max_zcr
+        self.hangover = hangover_ms * SAMPLE_RATE // 1000 // VAD_FRAME_SAMPLES
+        self.preroll = preroll_ms * SAMPLE_RATE // 1000 // VAD_FRAME_SAMPLES
+        self._remainder = b""
+        self._hang = 0  # Hangover frames still owed from the previous block
+        self._tail = np.empty((0, VAD_FRAME_SAMPLES), dtype="<i2")  # Dropped frames kept for pre-roll
+        self.decoded_frames = 0
+        self.skipped_frames = 0
+
+    def filter(self, pcm):
+        """
+        Drop the non-speech frames from a block of audio.
+
+        Args:
+            pcm (bytes): 16 kHz mono 16-bit little-endian PCM.
+
+        Returns:
+            bytes: The frames to decode, possibly empty.
+        """
+        data = self._remainder + pcm if self._remainder else pcm
+        count = len(data) // (VAD_FRAME_SAMPLES * 2)
+        self._remainder = data[count * VAD_FRAME_SAMPLES * 2:]
+        if count == 0:
+            return b""
+        frames = np.frombuffer(data, dtype="<i2", count=count * VAD_FRAME_SAMPLES).reshape(count, VAD_FRAME_SAMPLES)
+        samples = frames.astype(np.float32)
+        power = np.mean(samples * samples, axis=1)
+        signs = np.signbit(frames)
+        zcr = np.count_nonzero(signs[:, 1:] != signs[:, :-1], axis=1) / (VAD_FRAME_SAMPLES - 1)
+        speech = (power > self.threshold) & (zcr < self.max_zcr)
+
+        # Keep frames close after the last speech frame (hangover) or close before the next one (pre-roll)
+        index = np.arange(count)
+        last = np.maximum.accumulate(np.where(speech, index, -self.hangover - 1))
+        following = np.minimum.accumulate(np.where(speech, index, count + self.preroll)[::-1])[::-1]
+        keep = (index - last <= self.hangover) | (following - index <= self.preroll) | (index < self._hang)
+
+        blocks = []
+        if speech.any():
+            # Pre-roll reaching back into frames dropped at the end of the previous block
+            missing = min(self.preroll - int(np.argmax(speech)), len(self._tail))
+            if missing > 0:
+                blocks.append(self._tail[-missing:])
+                self.decoded_frames += missing
+                self.skipped_frames -= missing
+            self._hang = max(0, self.hangover - (count - 1 - int(last[-1])))
+        else:
+            self._hang = max(0, self._hang - count)
+
+        kept = np.flatnonzero(keep)
+        if kept.size == 0:
+            self._tail = np.concatenate([self._tail, frames[-self.preroll:]])[-self.preroll:] if self.preroll else self._tail
+        else:
+            dropped = count - 1 - int(kept[-1])
+            self._tail = frames[count - min(dropped, self.preroll):].copy() if dropped else self._tail[:0]
+
+        blocks.append(frames[keep])
+        self.decoded_frames += kept.size
+        self.skipped_frames += count - kept.size
+        return b"".join(block.tobytes() for block in blocks)
+
+    def stats(self):
+        """
+        Report how many 20 ms frames were decoded and how many were skipped as non-speech.
+        """
+        return {"decoded_frames": self.decoded_frames, "skipped_frames": self.skipped_frames,
+                "frame_ms": VAD_FRAME_SAMPLES * 1000 // SAMPLE_RATE}
+
+class BeepDetector:
+    """
+    Streaming detector for answering-machine beeps: a single steady tone.
+
+    Audio is cut into 32 ms Hann-windowed frames and each block goes through one batched
+    FFT. A frame is tonal if it is louder than BEEP_THRESHOLD_DB, its strongest bin lies
+    between BEEP_MIN_HZ and BEEP_MAX_HZ, and at least BEEP_PURITY of its energy sits in
+    that peak and its neighbouring bins. Speech and dual-tone ringback spread their energy and
+    fail the purity test.
+    A run of tonal frames at the same frequency lasting BEEP_MIN_MS is reported once, with
+    the offset of its onset in the session's audio.
+    """
+
+    def __init__(self, stop_on_beep=False):
+        self.stop_on_beep = stop_on_beep
+        self.window = np.hanning(BEEP_WINDOW).astype(np.float32)
+        freqs = np.fft.rfftfreq(BEEP_WINDOW, 1 / SAMPLE_RATE)
+        self.band = (int(np.searchsorted(freqs, BEEP_MIN_HZ)), int(np.searchsorted(freqs, BEEP_MAX_HZ, side="right")))
+        self.threshold = (32768.0 ** 2) * 10 ** (BEEP_THRESHOLD_DB / 10)
+        self.min_frames = max(1, -(-BEEP_MIN_MS * SAMPLE_RATE // 1000 // BEEP_WINDOW))
+        self._remainder = b""
+        self._offset = 0  # Samples analysed so far
+        self._run = 0  # Consecutive tonal frames at _run_bin
+        self._run_bin = -1
+        self._run_start = 0
+        self._run_freqs = []
+        self._events = []
+        self.beeps = 0
+
+    def process(self, pcm):
+        """
+        Analyse a block of audio.
+
+        Args:
+            pcm (bytes): 16 kHz mono 16-bit little-endian PCM.
+
+        Returns:
+            bool: True if a new beep was found in this block.
+        """
+        data = self._remainder + pcm if self._remainder else pcm
+        count = len(data) // (BEEP_WINDOW * 2)
+        self._remainder = data[count * BEEP_WINDOW * 2:]
+        if count == 0:
+            return False
+        samples = np.frombuffer(data, dtype="<i2", count=count * BEEP_WINDOW).reshape(count, BEEP_WINDOW).astype(np.float32)
+        spectrum = np.abs(np.fft.rfft(samples * self.window, axis=1)) ** 2
+        low, high = self.band
+        peak = np.argmax(spectrum[:, low:high], axis=1) + low
+        # A pure tone keeps nearly all its windowed energy within one bin of the peak;
+        # two tones 40 Hz apart (ringback) do not
+        lobe = np.clip(peak[:, None] + np.arange(-1, 2), 0, spectrum.shape[1] - 1)
+        rows = np.arange(count)[:, None]
+        purity = spectrum[rows, lobe].sum(axis=1) / (spectrum.sum(axis=1) + 1e-9)
+        tonal = (purity >= BEEP_PURITY) & (np.mean(samples * samples, axis=1) > self.threshold)
+
+        # Parabolic interpolation of the peak on a log scale for a finer frequency estimate
+        log_spectrum = np.log(spectrum[rows, lobe] + 1e-9)
+        a, b, c = log_spectrum[:, 0], log_spectrum[:, 1], log_spectrum[:, 2]
+        shift = np.clip(0.5 * (a - c) / np.where(a - 2 * b + c == 0, -1e-9, a - 2 * b + c), -0.5, 0.5)
+        frequency = (peak + shift) * SAMPLE_RATE / BEEP_WINDOW
+
+        found = False
+        for i in range(count):
+            if not tonal[i]:
+                self._run = 0
+                continue
+            if self._run and abs(int(peak[i]) - self._run_bin) <= 1:
+                self._run += 1
+            else:
+                self._run, self._run_bin, self._run_start, self._run_freqs = 1, int(peak[i]), self._offset + i * BEEP_WINDOW, []
+            self._run_freqs.append(float(frequency[i]))
+            if self._run == self.min_frames:
+                self.beeps += 1
+                self._events.append({
+                    "event": "beep",
+                    "offset_ms": self._run_start * 1000 // SAMPLE_RATE,
+                    "frequency_hz": round(sum(self._run_freqs) / len(self._run_freqs))
+                })
+                found = True
+        self._offset += count * BEEP_WINDOW
+        return found
+
+    def take_events(self):
+        """
+        Return the beep events found since the last call.
+        """
+        events, self._events = self._events, []
+        return events
+
+class StreamingDecoder:
+    """
+    Per-session audio decoder backed by one long-lived ffmpeg process.
+
+    Compressed bytes are written to ffmpeg's stdin as they arrive and 16 kHz mono
+    16-bit PCM is read back from stdout, so frames split across WebSocket messages
+    decode without gaps and no process is spawned per chunk.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.process = None
+        self.stderr_task = None
+        self.stderr_tail = b""
+
+    async def start(self):
+        """
+        Spawn the ffmpeg process for the session.
+
+        Returns:
+            str: Error message if the decoder could not be started, otherwise None.
+        """
+        file_extension = os.path.splitext(self.filename)[1].lower()
+        if file_extension not in ['.mp3', '.wav']:
+            return f"Unsupported file format: {file_extension}"
+        try:
+            self.process = await asyncio.create_subprocess_exec(
+                FFMPEG_PATH, "-hide_banner", "-loglevel", "error",
+                "-f", file_extension[1:], "-i", "pipe:0",
+                "-ac", "1", "-ar", str(SAMPLE_RATE), "-f", "s16le", "pipe:1",
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE
+            )
+        except Exception as e:
+            logger.error(f"Error starting ffmpeg: {e}")
+            return f"Error starting audio decoder: {str(e)}"
+        self.stderr_task = asyncio.create_task(self._collect_stderr())
+        return None
+
+    async def write(self, data):
+        """
+        Feed compressed audio to the decoder, waiting while ffmpeg's input pipe is full.
+
+        Returns:
+            str: Error message if the decoder is no longer accepting input, otherwise None.
+        """
+        try:
+            self.process.stdin.write(data)
+            await self.process.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError) as e:
+            logger.error(f"Audio decoder stopped accepting input: {e}")
+            return f"Error converting audio: decoder exited ({await self._stderr()})"
+        return None
+
+    async def read(self):
+        """
+        Read the next block of PCM audio.
+
+        Returns:
+            bytes: Up to PCM_FRAME_BYTES of 16-bit PCM, or b"" once the decoder is drained.
+        """
+        try:
+            return await self.process.stdout.readexactly(PCM_FRAME_BYTES)
+        except asyncio.IncompleteReadError as e:
+            # Final short block; drop a dangling odd byte so samples stay aligned
+            return e.partial[:len(e.partial) - len(e.partial) % 2]
+
+    async def finish(self):
+        """
+        Signal end of input so ffmpeg flushes its remaining output.
+        """
+        if self.process.stdin.can_write_eof():
+            self.process.stdin.write_eof()
+        self.process.stdin.close()
+
+    async def wait(self):
+        """
+        Wait for ffmpeg to exit.
+
+        Returns:
+            str: Error message if ffmpeg failed, otherwise None.
+        """
+        returncode = await self.process.wait()
+        if returncode != 0:
+            return f"Error converting audio: {await self._stderr()}"
+        return None
+
+    async def abort(self):
+        """
+        Kill the ffmpeg process if it is still running.
+        """
+        if self.process is not None and self.process.returncode is None:
+            try:
+                self.process.kill()
+            except ProcessLookupError:
+                pass
+            # Drain the pipes too: unread output left in a full stdout buffer
+            # keeps the process from ever being reaped
+            await self.process.stdout.read()
+            await self.stderr_task
+            await self.process.wait()
+
+    async def _collect_stderr(self):
+        # Read stderr while ffmpeg runs: warnings about a damaged file can fill the
+        # pipe, and ffmpeg would then block with the session's recognizer checked out
+        while True:
+            chunk = await self.process.stderr.read(FFMPEG_STDERR_BYTES)
+            if not chunk:
+                return
+            self.stderr_tail = (self.stderr_tail + chunk)[-FFMPEG_STDERR_BYTES:]
+
+    async def _stderr(self):
+        try:
+            await asyncio.wait_for(asyncio.shield(self.stderr_task), timeout=1.0)
+        except asyncio.TimeoutError:
+            pass
+        return self.stderr_tail.decode(errors="replace").strip() or "ffmpeg exited"
+
+def decode_pcm(rec, pcm, vad=None, beeps=None):
+    """
+    Feed a block of 16 kHz mono PCM to the recognizer. Runs on the decode executor.
+
+    Vosk releases the GIL while decoding, so blocks from different sessions decode
+    in parallel on separate worker threads.
+
+    Args:
+        rec (KaldiRecognizer): Recognizer checked out by the session.
+        pcm (bytes): 16-bit little-endian PCM audio.
+        vad (VoiceActivityDetector): Session VAD; non-speech frames are not decoded.
+        beeps (BeepDetector): Session beep detector; runs on all audio, before the VAD.
+
+    Returns:
+        dict: Final result if the recognizer reached an endpoint, otherwise a partial result,
+            or None if the VAD dropped the whole block or a beep ends the session.
+    """
+    if beeps is not None and beeps.process(pcm) and beeps.stop_on_beep:
+        return None  # The session stops at the beep, so the block is not decoded
+    if vad is not None:
+        pcm = vad.filter(pcm)
+        if not pcm:
+            return None
+    if rec.AcceptWaveform(pcm):
+        return json.loads(rec.Result())
+    return json.loads(rec.PartialResult())
+
+def decode_raw(rec, pcm_decoder, data, vad=None, beeps=None):
+    """
+    Decode a raw PCM or G.711 frame in-process and feed it to the recognizer. Runs on the decode executor.
+
+    Args:
+        rec (KaldiRecognizer): Recognizer checked out by the session.
+        pcm_decoder (PcmDecoder): Session decoder for the declared input encoding.
+        data (bytes): Raw audio frame.
+        vad (VoiceActivityDetector): Session VAD; non-speech frames are not decoded.
+        beeps (BeepDetector): Session beep detector.
+
+    Returns:
+        dict: Final or partial result, or None if the frame held no complete samples or no speech.
+    """
+    pcm = pcm_decoder.decode(data)
+    if not pcm:
+        return None
+    return decode_pcm(rec, pcm, vad, beeps)
+
+class EarlyDecision:
+    """
+    Classify a session's transcript as results stream in and settle on a decision as early as possible.
+
+    Voicemail phrases decide immediately, even from a partial result. Honeypot phrases only decide
+    once the recognizer finalizes the utterance, so a voicemail phrase later in the same utterance
+    still takes priority as it does in /api/respond.
+    """
+
+    def __init__(self):
+        self.final_texts = []
+        self.decision = None
+        self.keyword = None
+        self.transcript = ""
+
+    def update(self, result):
+        """
+        Update the transcript with a recognizer result.
+
+        Args:
+            result (dict): Final ("text") or partial ("partial") recognizer result.
+
+        Returns:
+            str: "VM" or "No VM" if this result settled the decision, otherwise None.
+        """
+        if self.decision is not None:
+            return None
+        if "text" in result:
+            self.final_texts.append(result["text"])
+            parts, is_final = self.final_texts, True
+        else:
+            parts, is_final = self.final_texts + [result.get("partial", "")], False
+        transcript = " ".join(part for part in parts if part)
+
+        decision, match = get_matcher().classify(transcript)
+        if decision == "VM" or (decision == "No VM" and is_final):
+            self.decision = decision
+            self.keyword = match["keyword"]
+            self.transcript = transcript
+            return decision
+        return None
+
+    def settle(self, decision, keyword):
+        """
+        Decide without a keyword match, e.g. on an acoustic beep.
+        """
+        if self.decision is None:
+            self.decision = decision
+            self.keyword = keyword
+            self.transcript = " ".join(text for text in self.final_texts if text)
+
+class RecognitionSession:
+    """
+    One transcription session: its recognizer, decoder and early-decision state.
+
+    A plain connection carries a single session. A multiplexed connection carries many,
+    and every message to and from a session is tagged with its session ID.
+    """
+
+    def __init__(self, websocket, session_id=None):
+        self.websocket = websocket
+        self.session_id = session_id
+        self.rec = None
+        self.pool = None
+        self.audio_started = False
+        self.filename = "input.wav"
+        self.decoder = None
+        self.pcm_decoder = None
+        self.pump_task = None
+        self.decode_future = None
+        self.early = None
+        self.vad = VoiceActivityDetector() if VAD_ENABLED else None
+        self.beeps = BeepDetector() if BEEP_ENABLED else None
+
+    @property
+    def decided(self):
+        return self.early is not None and self.early.decision is not None
+
+    async def send(self, payload):
+        """
+        Send a JSON message to the client, tagged with the session ID on multiplexed connections.
+        """
+        if self.session_id is not None:
+            payload = {"session": self.session_id, **payload}
+        await self.websocket.send(json.dumps(payload))
+
+    async def acquire(self, pool):
+        """
+        Check out a recognizer from a pool, returning the one the session held before, if any.
+
+        Sessions check out a recognizer only once the first config or audio frame shows
+        which pool they need, so keyword sessions never wait on the full-vocabulary pool.
+
+        Returns:
+            bool: False if no recognizer became available (the client has been told).
+        """
+        try:
+            rec = await pool.acquire()
+        except asyncio.TimeoutError:
+            await self.send({"error": "No recognizer available, server is busy", "status": "Server busy"})
+            return False
+        if self.rec is not None:
+            self.pool.release(self.rec)
+        self.rec, self.pool = rec, pool
+        await self.send({"status": "Recognizer ready", "pool": pool.stats()})
+        return True
+
+    async def use_keyword_grammar(self):
+        """
+        Give the session a recognizer limited to the keyword phrases.
+
+        Returns:
+            bool: False if no keyword recognizer became available (the client has been told).
+        """
+        version, pool = await grammar_pools.get()
+        logger.debug(f"Using keyword grammar {version}")
+        return pool is self.pool or await self.acquire(pool)
+
+    async def send_result(self, result):
+        """
+        Send a final or partial recognizer result to the client, followed by a decision event
+        if the result settled the session's early decision.
+
+        Returns:
+            str: The decision reached with this result, otherwise None.
+        """
+        await self.send(result)
+        if "text" in result:
+            logger.info(f"Sent final result: {result}")
+        else:
+            logger.debug(f"Sent partial result: {result}")
+
+        decision = self.early.update(result) if self.early is not None else None
+        if decision:
+            await self.send({"decision": decision, "keyword": self.early.keyword, "transcript": self.early.transcript})
+            logger.info(f"Early decision {decision} from transcript: {self.early.transcript}")
+        return decision
+
+    async def send_beeps(self):
+        """
+        Send beep events found since the last block, deciding VM on a beep if the session asked to stop on one.
+
+        Returns:
+            bool: True if a beep settled the session's decision.
+        """
+        if self.beeps is None:
+            return False
+        for event in self.beeps.take_events():
+            await self.send(event)
+            logger.info(f"Beep at {event['offset_ms']} ms ({event['frequency_hz']} Hz)")
+            if self.beeps.stop_on_beep and not self.decided:
+                if self.early is None:
+                    self.early = EarlyDecision()
+                self.early.settle("VM", "beep")
+                await self.send({"decision": "VM", "keyword": "beep", "transcript": self.early.transcript})
+                logger.info(f"Early decision VM from beep at {event['offset_ms']} ms")
+                return True
+        return False
+
+    async def run_decode(self, func, *args):
+        """
+        Run a recognizer call on the decode executor.
+
+        The call is shielded and kept in `decode_future`: if the session is cancelled, the
+        decode thread keeps using the recognizer, and close() waits for it before the
+        recognizer is reset and goes back to the pool.
+        """
+        loop = asyncio.get_running_loop()
+        self.decode_future = loop.run_in_executor(decode_executor, func, *args)
+        return await asyncio.shield(self.decode_future)
+
+    async def pump_decoder(self):
+        """
+        Move decoded PCM from the session decoder into the recognizer and send results as they arrive.
+        """
+        while True:
+            pcm = await self.decoder.read()
+            if not pcm:
+                break
+            result = await self.run_decode(decode_pcm, self.rec, pcm, self.vad, self.beeps)
+            decided = await self.send_beeps()
+            if result is not None and await self.send_result(result):
+                decided = True
+            if decided:
+                # Decision made: stop decoding the rest of the audio
+                await self.decoder.abort()
+                break
+
+    async def handle(self, message):
+        """
+        Process one client message.
+
+        Args:
+            message (str | bytes): JSON control message or audio frame.
+
+        Returns:
+            bool: True once the session has sent its final transcription or could not get a recognizer.
+        """
+        if isinstance(message, bytes):
+            return await self.handle_audio(message)
+        if not isinstance(message, str):
+            error_msg = "Unsupported message type"
+            logger.error(error_msg)
+            await self.send({"error": error_msg})
+            return False
+        try:
+            config = json.loads(message)
+        except json.JSONDecodeError as e:
+            error_msg = f"Invalid JSON: {str(e)}"
+            logger.error(error_msg)
+            await self.send({"error": error_msg})
+            return False
+        logger.debug(f"Received JSON: {config}")
+        return await self.handle_control(config)
+
+    async def handle_control(self, config):
+        """
+        Apply a JSON control message (filename, config or eof).
+
+        Returns:
+            bool: True once the session has sent its final transcription or could not get a recognizer.
+        """
+        if "filename" in config:
+            self.filename = config["filename"]
+            await self.send({"status": f"Received filename: {self.filename}"})
+        if "config" in config:
+            options = config["config"] if isinstance(config["config"], dict) else {}
+            if "encoding" in options:
+                encoding, sample_rate, error = parse_encoding(options["encoding"], options.get("sample_rate"))
+                if error:
+                    await self.send({"error": error})
+                    return False
+                self.pcm_decoder = PcmDecoder(encoding, sample_rate)
+                logger.debug(f"Using in-process decoder for {encoding}@{sample_rate}")
+            mode = options.get("mode", "full")
+            if mode not in ("full", "keywords"):
+                await self.send({"error": f"Unsupported recognizer mode: {mode}"})
+                return False
+            if mode == "keywords":
+                if self.audio_started:
+                    await self.send({"error": "Recognizer mode must be set before sending audio"})
+                    return False
+                if not await self.use_keyword_grammar():
+                    return True
+            elif self.rec is None and not await self.acquire(recognizer_pool):
+                return True
+            if options.get("early_decision"):
+                self.early = EarlyDecision()
+            if "vad" in options:
+                self.vad = VoiceActivityDetector() if options["vad"] else None
+            if "beep" in options or "stop_on_beep" in options:
+                detect = options.get("beep") or options.get("stop_on_beep")
+                self.beeps = BeepDetector(stop_on_beep=bool(options.get("stop_on_beep"))) if detect else None
+            self.rec.SetMaxAlternatives(0)
+            self.rec.SetWords(True)
+            await self.send({"status": "Configuration applied"})
+        if "eof" in config:
+            await self.finish()
+            return True
+        return False
+
+    async def handle_audio(self, data):
+        """
+        Feed an audio frame to the session's decoder.
+
+        Returns:
+            bool: True if the session could not get a recognizer and is over.
+        """
+        logger.debug(f"Processing audio data, size: {len(data)} bytes")
+        if self.rec is None and not await self.acquire(recognizer_pool):
+            return True
+        self.audio_started = True
+        if self.decided:
+            # Decision already made; the rest of the audio is not decoded
+            return False
+        if self.pcm_decoder is not None:
+            # Raw PCM / telephony fast path: no ffmpeg, decoded in-process
+            result = await self.run_decode(decode_raw, self.rec, self.pcm_decoder, data, self.vad, self.beeps)
+            if await self.send_beeps():
+                return False
+            if result is not None:
+                await self.send_result(result)
+            return False
+
+        if self.decoder is None:
+            decoder = StreamingDecoder(self.filename)
+            error = await decoder.start()
+            if error:
+                await self.send({"error": error})
+                return False
+            self.decoder = decoder
+            self.pump_task = asyncio.create_task(self.pump_decoder())
+
+        error = await self.decoder.write(data)
+        if error and not self.decided:
+            await self.send({"error": error})
+        return False
+
+    async def finish(self):
+        """
+        Flush the remaining audio through the recognizer and send the final transcription.
+        """
+        start_time = time.time()
+        if self.decoder is not None and not self.decided:
+            # Flush the decoder and let the pump feed the remaining audio
+            await self.decoder.finish()
+            await self.pump_task
+            error = await self.decoder.wait() if not self.decided else None
+            if error:
+                await self.send({"error": error})
+        if self.decided or self.rec is None:
+            # Decided early, or ended before any config or audio checked out a recognizer
+            result = {"text": ""}
+        else:
+            result = json.loads(await self.run_decode(self.rec.Result))
+            if self.early is not None:
+                self.early.update(result)
+        if self.decided:
+            result["decision"] = self.early.decision
+        if self.vad is not None:
+            result["vad"] = self.vad.stats()
+        if self.beeps is not None:
+            result["beeps"] = self.beeps.beeps
+        result["status"] = "Final transcription"
+        await self.send(result)
+        logger.info(f"Sent final result: {result}, took {time.time() - start_time:.2f} seconds")
+
+    async def close(self):
+        """
+        Stop decoding and return the recognizer to the pool.
+        """
+        if self.pump_task is not None and not self.pump_task.done():
+            self.pump_task.cancel()
+            try:
+                await self.pump_task
+            except (asyncio.CancelledError, Exception):
+                pass
+        if self.decoder is not None:
+            await self.decoder.abort()
+        if self.decode_future is not None and not self.decode_future.done():
+            # Let the in-flight decode finish before the recognizer goes back to the pool
+            await asyncio.wait([self.decode_future])
+        if self.rec is not None:
+            self.pool.release(self.rec)
+            self.rec = None
+
+async def run_session(session, messages):
+    """
+    Process one multiplexed session's messages in order until it finishes or the connection closes.
+
+    Args:
+        session (RecognitionSession): The session.
+        messages (asyncio.Queue): Messages routed to this session by the connection reader.
+    """
+    try:
+        while True:
+            message = await messages.get()
+            if isinstance(message, dict):
+                if message.get("cancel"):
+                    logger.info(f"Session {session.session_id} cancelled by client")
+                    return
+                if await session.handle_control(message):
+                    return
+            else:
+                if await session.handle_audio(message):
+                    return
+                # Acknowledge the frame so the client can send the next one
+                await session.send({"ack": 1})
+    except websockets.exceptions.ConnectionClosed:
+        pass
+    except Exception as e:
+        logger.error(f"Error in session {session.session_id}: {e}")
+        try:
+            await session.send({"error": str(e)})
+        except websockets.exceptions.ConnectionClosed:
+            pass
+    finally:
+        await session.close()
+        # Unblock the connection reader if it is waiting on a full inbox
+        while not messages.empty():
+            messages.get_nowait()
+
+async def serve_multiplexed(websocket):
+    """
+    Route messages on a multiplexed connection to their sessions.
+
+    Text messages carry a `session` field; binary frames start with the session ID as a
+    4-byte big-endian integer. Session IDs must increase over the life of a connection,
+    so late messages for a finished session are recognised and dropped. Each session
+    runs in its own task with a bounded inbox of MUX_SESSION_INBOX messages, reported to
+    the client in the hello reply so it can size its send window. A session that
+    overflows its inbox is failed instead of stalling the reader for every other
+    session on the connection.
+    """
+    sessions = {}  # Session ID -> (inbox, task) for live sessions
+    highest_session_id = 0
+    try:
+        async for message in websocket:
+            if isinstance(message, bytes):
+                if len(message) < 4:
+                    continue
+                session_id = int.from_bytes(message[:4], "big")
+                payload = message[4:]
+            else:
+                try:
+                    payload = json.loads(message)
+                    session_id = int(payload.pop("session"))
+                except (json.JSONDecodeError, AttributeError, KeyError, TypeError, ValueError):
+                    await websocket.send(json.dumps({"error": "Multiplexed messages need a session ID"}))
+                    continue
+
+            entry = sessions.get(session_id)
+            if entry is None:
+                if session_id <= highest_session_id or (isinstance(payload, dict) and payload.get("cancel")):
+                    continue  # Late message for a session that already finished
+                highest_session_id = session_id
+                if draining:
+                    # Later messages for this ID are dropped as late; the client retries elsewhere
+                    await websocket.send(json.dumps({"session": session_id, "error": "Server draining",
+                                                     "status": "Server draining", "retryable": True}))
+                    continue
+                inbox = asyncio.Queue(maxsize=MUX_SESSION_INBOX)
+                task = asyncio.create_task(run_session(RecognitionSession(websocket, session_id), inbox))
+                task.add_done_callback(lambda _, sid=session_id: sessions.pop(sid, None))
+                entry = sessions[session_id] = (inbox, task)
+            try:
+                entry[0].put_nowait(payload)
+            except asyncio.QueueFull:
+                logger.warning(f"Session {session_id} overflowed its inbox, failing it")
+                sessions.pop(session_id, None)
+                entry[1].cancel()
+                await websocket.send(json.dumps({"session": session_id, "error": "Session inbox full",
+                                                 "retryable": True}))
+    finally:
+        tasks = [task for _, task in sessions.values()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+async def receive_with_keepalive(websocket, timeout=120.0):
+    """
+    Wait for the next client message, sending a keepalive status every `timeout` seconds.
+    """
+    while True:
+        try:
+            message = await asyncio.wait_for(websocket.recv(), timeout=timeout)
+            logger.debug(f"Received message type: {type(message)}")
+            return message
+        except asyncio.TimeoutError:
+            logger.warning("Receive timeout, sending keepalive")
+            await websocket.send(json.dumps({"status": "Keepalive"}))
+
+async def recognize(websocket, path=None):
+    """
+    Handle WebSocket connections, process JSON configs and audio data, and send transcription results.
+
+    A connection whose first message is {"multiplex": 1} carries many tagged sessions
+    (see serve_multiplexed); any other connection carries one untagged session.
+
+    Args:
+        websocket: WebSocket connection object.
+        path: WebSocket path (unused).
+    """
+    session = None
+    try:
+        message = await receive_with_keepalive(websocket)
+        if isinstance(message, str) and '"multiplex"' in message:
+            try:
+                hello = json.loads(message)
+            except json.JSONDecodeError:
+                hello = {}
+            if isinstance(hello, dict) and hello.get("multiplex"):
+                await websocket.send(json.dumps({"status": "Multiplexing enabled", "inbox": MUX_SESSION_INBOX}))
+                await serve_multiplexed(websocket)
+                return
+
+        session = RecognitionSession(websocket)
+        while not await session.handle(message):
+            message = await receive_with_keepalive(websocket)
+
+    except websockets.exceptions.ConnectionClosedError as e:
+        logger.warning(f"WebSocket connection closed: {e}")
+    except Exception as e:
+        logger.error(f"Error in WebSocket handler: {e}")
+        try:
+            await websocket.send(json.dumps({"error": str(e)}))
+        except websockets.exceptions.ConnectionClosedError:
+            logger.warning("Failed to send error message: connection already closed")
+    finally:
+        if session is not None:
+            await session.close()
+
+async def drain(server):
+    """
+    Stop accepting connections, give running sessions up to DRAIN_TIMEOUT seconds to
+    finish, then close the remaining connections. Multiplexed connections stay open for
+    their running sessions but refuse new ones.
+    """
+    global draining
+    draining = True
+    server.close(close_connections=False)
+    deadline = time.monotonic() + DRAIN_TIMEOUT
+    while recognizer_pool.in_use + grammar_pools.in_use and time.monotonic() < deadline:
+        await asyncio.sleep(0.2)
+    running = recognizer_pool.in_use + grammar_pools.in_use
+    if running:
+        logger.warning(f"Closing with {running} sessions still running")
+    # close() is idempotent, so the connections left open above are closed one by one (1001 going away)
+    await asyncio.gather(*(connection.close(1001) for connection in list(server.connections)),
+                         return_exceptions=True)
+    await server.wait_closed()
+
+async def serve(sock=None):
+    """
+    Fill the recognizer pool and run the WebSocket server until SIGTERM or SIGINT,
+    then drain it.
+
+    Args:
+        sock (socket.socket): Listening socket shared by pre-forked workers; if None the
+            server binds SERVER_HOST:SERVER_PORT itself.
+    """
+    global recognizer_pool, grammar_pools, decode_executor
+    start_watcher()  # Early decisions follow keyword file edits without a restart
+    recognizer_pool = RecognizerPool(model, RECOGNIZER_POOL_SIZE)
+    logger.info(f"Recognizer pool ready with {RECOGNIZER_POOL_SIZE} recognizers")
+    grammar_pools = GrammarPools(grammar_model or model)
+    decode_executor = ThreadPoolExecutor(max_workers=DECODE_WORKERS, thread_name_prefix="vosk-decode")
+    logger.info(f"Decode executor running {DECODE_WORKERS} worker threads")
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, stop.set)
+
+    address = {"sock": sock} if sock is not None else {"host": SERVER_HOST, "port": SERVER_PORT}
+    server = await websockets.serve(
+        recognize,
+        **address,
+        ping_interval=30,
+        ping_timeout=120,
+        close_timeout=10
+    )
+    logger.info(f"Vosk WebSocket server running on ws://{SERVER_HOST}:{SERVER_PORT} (pid {os.getpid()})")
+    await stop.wait()
+    logger.info(f"Shutting down, draining for up to {DRAIN_TIMEOUT:.0f} seconds")
+    await drain(server)
+    decode_executor.shutdown(wait=True)
+
+async def main():
+    """
+    Load the shared model and serve from this process with increased ping timeout for stability.
+    """
+    global model, grammar_model
+    if RECOGNIZER_STUB:
+        logger.warning("VOSK_STUB=1: serving stub recognizers, no model loaded")
+    elif not os.path.exists(MODEL_PATH):
+        logger.error(f"Vosk model not found at {MODEL_PATH}")
+        return
+    try:
+        if not RECOGNIZER_STUB:
+            model = load_model(MODEL_PATH)
+            if GRAMMAR_MODEL_PATH:
+                grammar_model = load_model(GRAMMAR_MODEL_PATH)
+        await serve()
+    except Exception as e:
+        logger.error(f"Error starting server: {e}")
+
+def run_worker(sock):
+    """
+    Body of a forked worker process; never returns.
+    """
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, signal.SIG_DFL)
+    code = 0
+    try:
+        asyncio.run(serve(sock))
+    except Exception as e:
+        logger.error(f"Worker {os.getpid()} failed: {e}")
+        code = 1
+    finally:
+        logging.shutdown()
+        os._exit(code)
+
+def supervise(workers=SERVER_WORKERS):
+    """
+    Load the model once, then pre-fork `workers` server processes that share it and
+    one listening socket.
+
+    The model is loaded before forking, so its pages are shared copy-on-write and
+    memory stays near one model copy however many workers run. Each worker creates
+    its own recognizer pool, decode threads and event loop after the fork. Workers
+    that exit unexpectedly are restarted; SIGTERM or SIGINT is passed on to every
+    worker, which drains its sessions, and workers still running DRAIN_TIMEOUT
+    seconds later are killed.
+    """
+    global model, grammar_model
+    if RECOGNIZER_STUB:
+        logger.warning("VOSK_STUB=1: serving stub recognizers, no model loaded")
+    elif not os.path.exists(MODEL_PATH):
+        logger.error(f"Vosk model not found at {MODEL_PATH}")
+        return
+    else:
+        model = load_model(MODEL_PATH)
+        if GRAMMAR_MODEL_PATH:
+            grammar_model = load_model(GRAMMAR_MODEL_PATH)
+    sock = socket.create_server((SERVER_HOST, SERVER_PORT), backlog=1024)
+    # Keep the loaded objects out of the collector's reach so it does not dirty shared pages
+    gc.freeze()
+
+    children = {}  # pid -> start time
+    stopping = []
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            run_worker(sock)
+        children[pid] = time.monotonic()
+        logger.info(f"Started worker {pid}")
+
+    def stop(signum, frame):
+        if not stopping:
+            logger.info(f"Stopping {len(children)} workers")
+            stopping.append(time.monotonic() + DRAIN_TIMEOUT)
+            for pid in children:
+                os.kill(pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for _ in range(workers):
+        spawn()
+    logger.info(f"Supervisor {os.getpid()} running {workers} workers on ws://{SERVER_HOST}:{SERVER_PORT}")
+
+    while children:
+        pid, status = os.waitpid(-1, os.WNOHANG)
+        if pid == 0:
+            if stopping and time.monotonic() > stopping[0]:
+                for pid in children:
+                    logger.warning(f"Worker {pid} did not drain in time, killing it")
+                    os.kill(pid, signal.SIGKILL)
+                stopping[0] = float("inf")
+            time.sleep(0.2)
+            continue
+        started = children.pop(pid, None)
+        if started is None or stopping:
+            continue
+        logger.error(f"Worker {pid} exited unexpectedly (status {status}), restarting")
+        if time.monotonic() - started < 5:
+            time.sleep(1)  # Do not spin on a worker that fails at startup
+        spawn()
+    sock.close()
+    logger.info("All workers stopped")
+
+if __name__ == "__main__":
+    if SERVER_WORKERS > 1:
+        supervise()
+    else:
+        asyncio.run(main())